@@ -1,8 +1,13 @@
 #!/usr/bin/python3
 
 import argparse
+import cProfile
+import json
+import logging
 import os
 from stawebg.data import Project, version
+from stawebg.helper import setupLog
+from stawebg.watch import watch
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="static website generator")
@@ -13,9 +18,93 @@ if __name__ == "__main__":
     parser.add_argument("-o", "--output", metavar="output",
                         type=str, default=None,
                         help='write output to this directory')
-    parser.add_argument("-v", "--version", action="version",
+    parser.add_argument("-i", "--incremental", action='store_true',
+                        help='only create files whose inputs have changed')
+    parser.add_argument("-j", "--jobs", metavar="N", type=int, default=1,
+                        help='create up to N pages at the same time')
+    parser.add_argument("-P", "--processes", metavar="N", type=int,
+                        default=1,
+                        help='create up to N sites at the same time in '
+                             'separate processes')
+    parser.add_argument("--site", metavar="name", type=str, action="append",
+                        dest="sites", default=None,
+                        help='only create this site (can be given more than '
+                             'once)')
+    parser.add_argument("-u", "--keep-unchanged", action='store_true',
+                        help='do not touch output files whose content is '
+                             'the same')
+    parser.add_argument("--changed", metavar="file", type=str, default=None,
+                        help='write the output files that were created, '
+                             'changed or removed to this file')
+    parser.add_argument("-w", "--watch", action='store_true',
+                        help='create changed pages again when files change')
+    parser.add_argument("-s", "--serve", metavar="port", type=int, nargs="?",
+                        const=8000, default=None,
+                        help='serve the output on localhost and reload open '
+                             'pages after changes (implies --watch)')
+    parser.add_argument("--stats", metavar="N", type=int, nargs="?",
+                        const=10, default=None,
+                        help='print how long the phases of the build took and '
+                             'the N slowest pages (default: 10)')
+    parser.add_argument("--stats-json", metavar="file", type=str,
+                        default=None,
+                        help='write the statistics as JSON to this file')
+    parser.add_argument("--profile", metavar="file", type=str, default=None,
+                        help='write cProfile data of the build to this file')
+    parser.add_argument("--no-cache", action='store_true',
+                        help='do not use the cache for markup conversion')
+    parser.add_argument("--clear-cache", action='store_true',
+                        help='remove all entries from the markup cache')
+    parser.add_argument("-q", "--quiet", action='store_true',
+                        help='only print warnings and errors')
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help='print every file that is found or removed')
+    parser.add_argument("-V", "--version", action="version",
                         version="%(prog)s " + version)
 
     args = parser.parse_args()
 
-    project = Project(args.directory, args.test, args.output)
+    if args.quiet:
+        setupLog(logging.WARNING)
+    elif args.verbose:
+        setupLog(logging.DEBUG)
+    else:
+        setupLog(logging.INFO)
+
+    def createProject():
+        project = Project(args.directory, args.test, args.output,
+                          not args.no_cache, args.clear_cache,
+                          args.incremental or args.watch or
+                          args.serve is not None, args.jobs,
+                          args.stats is not None or args.stats_json,
+                          args.sites, args.processes, args.keep_unchanged)
+        # Clear the cache only once in watch mode
+        args.clear_cache = False
+        return project
+
+    if args.watch or args.serve is not None:
+        watch(createProject, args.serve)
+    else:
+        profile = None
+        if args.profile:
+            profile = cProfile.Profile()
+            profile.enable()
+
+        project = createProject()
+        project.close()
+
+        if profile:
+            profile.disable()
+            profile.dump_stats(args.profile)
+
+        stats = project.getStats()
+        if args.stats is not None:
+            print(stats.report(args.stats))
+        if args.stats_json:
+            with open(args.stats_json, "wt") as f:
+                json.dump(stats.toDict(args.stats or 10), f, indent=4)
+        if args.changed:
+            out_dir = project.getOutputDir()
+            with open(args.changed, "wt") as f:
+                for path in sorted(project.getChangedFiles()):
+                    f.write(os.path.relpath(path, out_dir) + "\n")
@@ -1,3 +1,4 @@
 #!/usr/bin/python3
 
-__all__ = ["data", "helper"]
+__all__ = ["cache", "data", "helper", "manifest", "markup", "server",
+           "stats", "template", "watch"]
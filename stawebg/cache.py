@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from stawebg.helper import fail, log, mkdir
+
+
+class MarkupCache:
+    """ On-disk cache for the output of markup tools """
+    def __init__(self, path, max_size):
+        """ path: cache directory, max_size: size limit in bytes """
+        self._path = path
+        self._max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+    def clear(self):
+        if os.path.isdir(self._path):
+            try:
+                shutil.rmtree(self._path)
+            except OSError as e:
+                fail("Can't clear cache " + self._path + ": " + str(e))
+        self._size = None
+
+    def get(self, text, ext, tool):
+        path = self._getPath(self._getKey(text, ext, tool))
+
+        try:
+            with open(path, "rt") as f:
+                result = f.read()
+        except IOError:
+            return None
+
+        # Update time of last use for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return result
+
+    def put(self, text, ext, tool, result):
+        path = self._getPath(self._getKey(text, ext, tool))
+        mkdir(os.path.dirname(path))
+
+        # Write to temporary file first, so nobody sees half written entries
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wt") as f:
+                f.write(result)
+            os.replace(tmp, path)
+        except OSError as e:
+            log.warning("Warning: can't write to cache: " + str(e))
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._getSize()
+            else:
+                self._size += os.path.getsize(path)
+
+            if self._size > self._max_size:
+                self._evict()
+
+    def _getKey(self, text, ext, tool):
+        h = hashlib.sha256()
+        h.update(json.dumps([ext, tool]).encode())
+        h.update(b"\0")
+        h.update(text.encode())
+        return h.hexdigest()
+
+    def _getPath(self, key):
+        return os.path.join(self._path, key[:2], key[2:])
+
+    def _getEntries(self):
+        result = []
+        for d in os.listdir(self._path):
+            absd = os.path.join(self._path, d)
+            if not os.path.isdir(absd):
+                continue
+            for f in os.listdir(absd):
+                try:
+                    st = os.stat(os.path.join(absd, f))
+                except OSError:
+                    continue
+                result.append((st.st_mtime, st.st_size,
+                               os.path.join(absd, f)))
+        return result
+
+    def _getSize(self):
+        return sum(e[1] for e in self._getEntries())
+
+    def _evict(self):
+        # Remove least recently used entries until the cache is small enough
+        # again, leave some room to avoid evicting on every insert
+        limit = self._max_size * 0.9
+        entries = sorted(self._getEntries())
+        self._size = sum(e[1] for e in entries)
+
+        for mtime, size, path in entries:
+            if self._size <= limit:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
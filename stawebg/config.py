@@ -2,15 +2,25 @@
 
 import json
 import os
-from copy import deepcopy
-from stawebg.helper import fail
+import re
+from stawebg.helper import fail, log
+
+# Marks keys that are not in a config
+_MISSING = object()
 
 
 class Config:
+    """ Configuration read from a file or layered on top of other configs
+
+    merge() and copy() don't copy anything, the new config only stores its
+    own values (and deleted keys) and asks its parent for everything else.
+    Results of get() are cached until any config is changed.
+    """
     global_struct = {"dirs": (dict, {"sites": (str, None, False),
                                      "layouts": (str, None, False),
                                      "out": (str, None, False),
-                                     "test": (str, None, True)}, False),
+                                     "test": (str, None, True),
+                                     "cache": (str, None, True)}, False),
                      "files": (dict, {"index": (list, str, True),
                                       "content": (list, str, True),
                                       "hidden": (list, str, True),
@@ -18,7 +28,16 @@ class Config:
                      "markup": ("mapping",
                                 (str, (list, str, True), True),
                                 True),
+                     "converters": ("mapping",
+                                    (str, (dict,
+                                           {"module": (str, None, True),
+                                            "worker": (list, str, True)},
+                                           True), True),
+                                    True),
                      "delete-old": (bool, None, True),
+                     "copy": (dict, {"check": (str, None, True),
+                                     "method": (str, None, True)}, True),
+                     "cache-size": (int, None, True),
                      "layout": (str, None, True),
                      "locale" : (str, None, True),
                      "timeformat" : (str, None, True),
@@ -28,6 +47,7 @@ class Config:
                                    True)}
     site_struct = {"dirs": (None, None, None),
                    "markup": (None, None, None),
+                   "converters": (None, None, None),
                    "title": (str, None, True),
                    "subtitle": (str, None, True),
                    "layout": (str, None, True),
@@ -62,15 +82,33 @@ class Config:
                                            "copyright": (str, None, True),
                                            "show_generator": (bool, None, True),
                                            "title_length": (int, None, True),
-                                           "content_length": (int, None, True)},
+                                           "content_length": (int, None, True),
+                                           "max-items": (int, None, True)},
                                           True)},
                                  True),
                         "variables": ("mapping",
                                        (str, str, True),
                                        True)}
 
+    # Incremented by add() and delete(), cached results are invalid then
+    _generation = 0
+
     def __init__(self, filename, struct, displayname=None):
+        # Own values, they are merged with the values of the parent
         self._config = {}
+        self._parent = None
+        self._overwrite_lists = False
+
+        # Keys (as tuples) deleted from the values of the parent
+        self._deleted = set()
+
+        # Key: key as tuple
+        # Value: result of _lookup()
+        self._results = {}
+        self._results_generation = Config._generation
+
+        self._files = []
+        self._classifier = None
 
         if displayname:
             self._displayname = displayname
@@ -78,6 +116,7 @@ class Config:
             self._displayname = filename
 
         if filename:  # filename is not set if Config is created in merge
+            self._files.append(filename)
             try:
                 conff = open(filename, "r")
                 try:
@@ -90,41 +129,99 @@ class Config:
             except IOError as e:
                 fail("Can't open file: " + filename + os.linesep + str(e))
 
+            # Check regular expressions now and not while reading the site
+            self.getClassifier()
+
     def get(self, key, do_fail=True, default=None):
-        config = self._config
-        for k in key:
-            config = config.get(k)
+        config = self._lookup(tuple(key))
 
-            if not config:
-                if do_fail:
-                    fail("Can't find config: " + '.'.join(key))
-                else:
-                    return default
+        if config is _MISSING or (key and not config):
+            if do_fail:
+                fail("Can't find config: " + '.'.join(key))
+            else:
+                return default
 
         return config
 
+    def getFiles(self):
+        return self._files
+
+    def getClassifier(self):
+        if not self._classifier:
+            patterns = tuple(tuple(self.get(["files", c], False, []))
+                             for c in FileClassifier.categories)
+            try:
+                self._classifier = FileClassifier.get(patterns)
+            except re.error as e:
+                fail("Error in regular expression in file " +
+                     self._displayname + ": " + str(e))
+        return self._classifier
+
     def delete(self, key, do_fail=False):
-        data = self.get(key[:-1], do_fail)
+        key = tuple(key)
+        if self._lookup(key) is _MISSING:
+            if do_fail:
+                fail("Can't find " + str(key))
+            return
 
-        if key[-1] in data:
+        # Remove own value and hide the one of the parent
+        data = _walk(self._config, key[:-1])
+        if type(data) == dict and key[-1] in data:
             del data[key[-1]]
-        elif do_fail:
-            fail("Can't find " + str(key))
+        if self._parent:
+            self._deleted.add(key)
+        self._changed()
 
     def add(self, key, value):
+        """ Set key to value, if it has no value yet """
+        if self.get(key, False):
+            return
+
         config = self._config
-        for n, k in enumerate(key):
-            if config.get(k):
-                config = config.get(k)
-            else:
-                if n == len(key)-1:
-                    config[k] = value
-                else:
-                    config[k] = {}
-                    config = config[k]
+        for k in key[:-1]:
+            if type(config.get(k)) != dict:
+                config[k] = {}
+            config = config[k]
+        config[key[-1]] = value
+        self._changed()
 
     def copy(self):
-        return deepcopy(self)
+        """ Config that shares all values with this one """
+        result = Config(None, None, self._displayname)
+        result._parent = self
+        result._files = self._files
+        result._classifier = self._classifier
+        return result
+
+    def _changed(self):
+        self._classifier = None
+        Config._generation += 1
+
+    def _lookup(self, key):
+        """ Value of key with all layers merged or _MISSING """
+        if self._results_generation != Config._generation:
+            self._results = {}
+            self._results_generation = Config._generation
+        elif key in self._results:
+            return self._results[key]
+
+        base = _MISSING
+        if self._parent and \
+           not any(key[:len(d)] == d for d in self._deleted):
+            base = self._parent._lookup(key)
+            # Deleted keys below key
+            for d in self._deleted:
+                if len(d) > len(key) and d[:len(key)] == key:
+                    base = _remove(base, d[len(key):])
+
+        own = _walk(self._config, key)
+        if own is _REPLACED:
+            result = _MISSING
+        else:
+            result = _mergeValues(base, own, self._overwrite_lists)
+
+        self._results[key] = result
+        return result
 
     def _checkDict(self, obj, struct):
         if not struct:
@@ -174,8 +271,8 @@ class Config:
                 fail("Can't find " + str(k) + " in " + self._displayname)
 
         if len(obj):
-            print("Warning: unknown config options in file " +
-                  self._displayname + ": " + str(obj))
+            log.warning("Warning: unknown config options in file " +
+                        self._displayname + ": " + str(obj))
 
         return result
 
@@ -218,26 +315,113 @@ class Config:
         if not b:
             return a
 
-        result_dict = deepcopy(a._config)
-        b_dict = b._config
-
-        result = Config._mergeDict(result_dict, b_dict, overwrite_lists)
+        # b becomes a layer on top of a
         result = Config(None, None, a._displayname + " or " + b._displayname)
-        result._config = result_dict
+        result._parent = a
+        result._config = b._lookup(()) if b._parent else b._config
+        result._overwrite_lists = overwrite_lists
+        result._files = a._files + b._files
 
         return result
 
-    @staticmethod
-    def _mergeDict(a, b, overwrite_lists):
-        for k in b:
-            if k in a:
-                if type(b[k]) == dict:
-                    a[k] = Config._mergeDict(a[k], b[k], overwrite_lists)
-                elif not overwrite_lists and type(b[k]) == list:
-                    a[k].extend(b[k])
-                else:
-                    a[k] = b[k]
-            else:
-                a[k] = b[k]
 
+# Returned by _walk() if a value on the way to the key is not a dictionary
+_REPLACED = object()
+
+
+def _walk(data, key):
+    for k in key:
+        if type(data) != dict:
+            return _REPLACED
+        data = data.get(k, _MISSING)
+        if data is _MISSING:
+            return _MISSING
+    return data
+
+
+def _mergeValues(a, b, overwrite_lists):
+    """ b on top of a: dictionaries are merged, lists extended (unless
+    overwrite_lists is set) and everything else is replaced """
+    if a is _MISSING:
+        return b
+    if b is _MISSING:
         return a
+
+    if type(a) == dict and type(b) == dict:
+        result = dict(a)
+        for k in b:
+            result[k] = _mergeValues(a.get(k, _MISSING), b[k],
+                                     overwrite_lists)
+        return result
+    elif not overwrite_lists and type(a) == list and type(b) == list:
+        return a + b
+    else:
+        return b
+
+
+def _remove(data, key):
+    """ Copy of data without key """
+    if type(data) != dict or key[0] not in data:
+        return data
+
+    result = dict(data)
+    if len(key) == 1:
+        del result[key[0]]
+    else:
+        result[key[0]] = _remove(data[key[0]], key[1:])
+    return result
+
+
+class FileClassifier:
+    """ Match relative paths against files.index, files.content, ... """
+    categories = ["index", "content", "hidden", "exclude"]
+
+    # Key: tuple of patterns for every category
+    # Value: FileClassifier
+    _instances = {}
+
+    @staticmethod
+    def get(patterns):
+        """ Configs with the same patterns share one classifier """
+        classifier = FileClassifier._instances.get(patterns)
+        if not classifier:
+            classifier = FileClassifier(patterns)
+            FileClassifier._instances[patterns] = classifier
+        return classifier
+
+    def __init__(self, patterns):
+        # One list of compiled regular expressions for every category
+        self._regex = [self._compile(p) for p in patterns]
+
+    def isIndex(self, path):
+        return self._match(0, path)
+
+    def isContent(self, path):
+        return self._match(1, path)
+
+    def isHidden(self, path):
+        return self._match(2, path)
+
+    def isExcluded(self, path):
+        return self._match(3, path)
+
+    def _match(self, category, path):
+        return any(r.match(path) for r in self._regex[category])
+
+    def _compile(self, patterns):
+        regex = []
+        for p in patterns:
+            try:
+                regex.append(re.compile(p))
+            except re.error as e:
+                raise re.error("\"" + p + "\": " + str(e))
+
+        # Combine all patterns to one regular expression. Groups would be
+        # numbered again, so backreferences could change their meaning, and
+        # global flags are only allowed at the start.
+        if len(regex) < 2 or any(r.groups for r in regex):
+            return regex
+        try:
+            return [re.compile("|".join("(?:" + p + ")" for p in patterns))]
+        except re.error:
+            return regex
@@ -1,43 +1,82 @@
 #!/usr/bin/python3
 
-import cgi
 import errno
+import html
+import io
 import locale
 import math
 import os
 import re
-import shutil
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from subprocess import Popen, PIPE
+from stawebg.cache import MarkupCache
 from stawebg.config import Config
-from stawebg.helper import (listFolders, findFiles, findDirs, fail, matchList,
-                            cleverCapitalize, cutStr, mkdir)
+from stawebg.manifest import Manifest
+from stawebg.markup import createConverter
+from stawebg.stats import Stats, timed
+from stawebg.template import Template, replaceKeywords
+from stawebg.helper import (listFolders, findFiles, scanDir, walkFiles,
+                            removeEmptyDirs, fail, log, flushLog, setupLog,
+                            cleverCapitalize, cutStr, mkdir, isCopy, JobQueue,
+                            Writer, openAtomic)
 
 version = "0.1-dev"
 
-isFile = lambda f: os.path.isfile(f)
-matchPath = lambda f, c: os.path.abspath(f)[len(os.path.abspath(c.getAbsSrcPath()))+1:]
-isIndex = lambda f, site: matchList(matchPath(f, site), site.getConfig(['files', 'index']))
-isCont = lambda f, site: matchList(matchPath(f, site), site.getConfig(['files', 'content']))
-isExcluded = lambda f, site, c: matchList(matchPath(f, site), c.get(['files', 'exclude'], False, []))
-isHidden = lambda f, site, c: matchList(matchPath(f, site), c.get(['files', 'hidden'], False, []))
+# Month names for RSS dates, they must not depend on the locale
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct",
+          "Nov", "Dec"]
+
+matchPath = lambda f, site: site.getRelPath(f)
+isIndex = lambda f, site: site.getClassifier().isIndex(matchPath(f, site))
+isCont = lambda f, site: site.getClassifier().isContent(matchPath(f, site))
+isExcluded = lambda f, site, c: c.getClassifier().isExcluded(matchPath(f, site))
+isHidden = lambda f, site, c: c.getClassifier().isHidden(matchPath(f, site))
 
 
 class Project:
-    def __init__(self, project_dir="", test=False, output=None):
+    def __init__(self, project_dir="", test=False, output=None, cache=True,
+                 clear_cache=False, incremental=False, jobs=1, stats=False,
+                 sites=None, processes=1, keep_unchanged=False):
+        self._stats = Stats(stats)
+
+        # Worker processes create their own project with these arguments
+        self._options = {"project_dir": project_dir, "test": test,
+                         "output": output, "cache": cache,
+                         "incremental": incremental, "jobs": jobs,
+                         "stats": stats, "keep_unchanged": keep_unchanged}
+        self._site_names = sites
+        self._processes = processes
         self._sites = []
         self._layouts = {}
+        self._layouts_lock = threading.Lock()
         self._root_dir = project_dir
         self._test = test
         self._other_output = output
-
-        self._config = Config(os.path.join(self._root_dir, "stawebg.json"),
-                              Config.global_struct)
+        self._incremental = incremental
+        self._jobs = jobs
+        self._keep_unchanged = keep_unchanged
+        self._build_time = None
+        self._writer = None
+        self._changed = []
+        self._manifests = {}
+        self._converters = {}
+        self._converters_lock = threading.Lock()
+        self._cache = None
+
+        with self._stats.phase("config"):
+            self._config = Config(os.path.join(self._root_dir, "stawebg.json"),
+                                  Config.global_struct)
 
         # Make directories absolute
         dirs = self._config.get(["dirs"])
         for k in dirs:
-            dirs[k] = os.path.join(self._root_dir, dirs[k])
+            dirs[k] = os.path.abspath(os.path.join(self._root_dir, dirs[k]))
 
         # Set locale
         try:
@@ -45,32 +84,199 @@ class Project:
         except locale.Error as e:
             fail("Failed to set the locale \"" + self.getConfig(["locale"], False, "") + "\": " + str(e))
 
-        # Add all layouts to list
-        for name in listFolders(self.getConfig(['dirs', 'layouts'])):
-            self._layouts[name] = Layout(self, name)
+        # How to copy other files
+        if self.getConfig(["copy", "check"], False, "mtime") not in \
+           ["mtime", "hash", "none"]:
+            fail("copy.check must be mtime, hash or none")
+        if self.getConfig(["copy", "method"], False, "copy") not in \
+           ["copy", "hardlink", "reflink"]:
+            fail("copy.method must be copy, hardlink or reflink")
+
+        # Cache for the output of markup tools
+        cache_dir = self.getConfig(["dirs", "cache"], False,
+                                   os.path.join(self._root_dir, ".cache"))
+        if clear_cache:
+            MarkupCache(cache_dir, 0).clear()
+        if cache:
+            self._cache = MarkupCache(cache_dir,
+                                      self.getConfig(["cache-size"], False, 100)
+                                      * 1024 * 1024)
+
+        self._readLayouts()
+        self.build()
+
+    def build(self, names=None):
+        """ Read and create the sites with the given names or all sites """
+        # All pages of this build get the same generation time, it can be
+        # fixed for reproducible output
+        epoch = os.environ.get("SOURCE_DATE_EPOCH")
+        if epoch:
+            try:
+                # Local time, like datetime.now()
+                self._build_time = datetime.fromtimestamp(int(epoch))
+            except (ValueError, OverflowError, OSError):
+                fail("Invalid SOURCE_DATE_EPOCH: " + epoch)
+        else:
+            self._build_time = datetime.now()
+        self._changed = []
+
+        all_names = listFolders(self.getConfig(['dirs', 'sites']))
+        for s in self._site_names or []:
+            if s not in all_names:
+                fail("Can't find site: " + s)
+
+        names = [s for s in all_names
+                 if (names is None or s in names) and
+                 (self._site_names is None or s in self._site_names)]
+
+        if self._processes > 1 and len(names) > 1:
+            self._buildInProcesses(names)
+            return
 
         # Add all site directories to list
-        for s in listFolders(self.getConfig(['dirs', 'sites'])):
+        self._sites = []
+        for s in names:
             site = Site(s, self)
             self._sites.append(site)
             site.read()
 
-        # copy files to out dir
-        for s in self._sites:
-            s.copy()
+        # copy files to out dir, pages are written in the background
+        jobs = JobQueue(self._jobs)
+        self._writer = Writer(max(2, self._jobs),
+                              keep_unchanged=self._keep_unchanged)
+        try:
+            for s in self._sites:
+                s.copy(jobs)
+        finally:
+            jobs.shutdown()
+            self._writer.close()
+            self._changed.extend(self._writer.getChanged())
+            flushLog()
+
+    def _buildInProcesses(self, names):
+        """ Create every site in its own process """
+        failed = []
+        try:
+            with ProcessPoolExecutor(min(self._processes, len(names))) as pool:
+                results = pool.map(_buildSite,
+                                   [(self._options, log.level, n)
+                                    for n in names])
+                # Print the output of one site after the other
+                for name, output, stats, changed, ok in results:
+                    flushLog()
+                    if ok:
+                        sys.stdout.write(output)
+                    else:
+                        failed.append(name)
+                        sys.stderr.write(output)
+                    if stats:
+                        self._stats.merge(stats)
+                    self._changed.extend(changed)
+        except BrokenProcessPool as e:
+            fail("Worker process died: " + str(e))
+
+        if failed:
+            fail("Failed to create sites: " + ", ".join(failed))
+
+    def rebuild(self, changed):
+        """ Create everything again that depends on the changed files """
+        layouts_dir = self.getConfig(['dirs', 'layouts']) + os.sep
+        sites_dir = self.getConfig(['dirs', 'sites']) + os.sep
+
+        names = set()
+        for path in changed:
+            if path.startswith(layouts_dir):
+                self._readLayouts()
+                names = None
+                break
+            elif path.startswith(sites_dir):
+                name = path[len(sites_dir):].split(os.sep)[0]
+                if name.endswith(".json"):
+                    name = name[:-len(".json")]
+                names.add(name)
+
+        if names is None or names:
+            self.build(names)
+
+    def close(self):
+        for c in self._converters.values():
+            if c:
+                c.close()
+        self._converters = {}
+
+    def getWatchPaths(self):
+        """ All files and directories the output depends on """
+        return [os.path.join(self._root_dir, "stawebg.json"),
+                self.getConfig(['dirs', 'sites']),
+                self.getConfig(['dirs', 'layouts'])]
+
+    @timed("layouts")
+    def _readLayouts(self):
+        """ Find the names of all layouts, they are loaded by getLayout() """
+        # Key: name
+        # Value: Layout or None if it is not used yet
+        self._layouts = dict((name, None) for name in
+                             listFolders(self.getConfig(['dirs', 'layouts'])))
 
     def getConfig(self, key, fail=True, default=None):
         return self._config.get(key, fail, default)
 
+    def getCache(self):
+        return self._cache
+
+    def getWriter(self):
+        return self._writer
+
+    def getBuildTime(self):
+        return self._build_time
+
+    def addChangedFile(self, path):
+        self._changed.append(path)
+
+    def getChangedFiles(self):
+        """ Output files that were created, changed or removed by the last
+        build """
+        return self._changed
+
+    def getStats(self):
+        return self._stats
+
+    def getConverter(self, ext):
+        with self._converters_lock:
+            if ext not in self._converters:
+                self._converters[ext] = createConverter(
+                    ext, self.getConfig(["markup"], False),
+                    self.getConfig(["converters"], False))
+            return self._converters[ext]
+
+    def isIncremental(self):
+        return self._incremental
+
+    def isKeepUnchanged(self):
+        return self._keep_unchanged
+
+    def getManifest(self, name):
+        """ Manifests are kept, so they are read only once in watch mode """
+        if name not in self._manifests:
+            self._manifests[name] = Manifest(os.path.join(self.getOutputDir(),
+                                                          ".stawebg",
+                                                          name + ".json"))
+        return self._manifests[name]
+
     def getLayout(self, name=None):
         if not name:
             name = "default"
 
-        layout = self._layouts.get(name)
-
-        if not layout:
+        if name not in self._layouts:
             fail("Can't find layout: " + name)
 
+        with self._layouts_lock:
+            layout = self._layouts[name]
+            if not layout:
+                with self._stats.phase("layouts"):
+                    layout = Layout(self, name)
+                self._layouts[name] = layout
+
         return layout
 
     def getOutputDir(self):
@@ -82,13 +288,47 @@ class Project:
             return self.getConfig(["dirs", "out"])
 
 
+def _buildSite(args):
+    """ Create one site in a worker process
+
+    Returns the name, the output (log and errors), the statistics, the
+    changed files and if it was successful.
+    """
+    options, level, name = args
+
+    output = io.StringIO()
+    setupLog(level, output)
+    stderr = sys.stderr
+    sys.stderr = output
+
+    project = None
+    ok = True
+    try:
+        project = Project(sites=[name], **options)
+        project.close()
+    except SystemExit:
+        ok = False
+    except Exception:
+        # Don't stop the other sites, report it with the output of this one
+        flushLog()
+        output.write(traceback.format_exc())
+        ok = False
+    finally:
+        flushLog()
+        sys.stderr = stderr
+
+    stats = project.getStats().toDict(None) if project else None
+    changed = project.getChangedFiles() if project else []
+    return name, output.getvalue(), stats, changed, ok
+
+
 class Layout:
     def __init__(self, project, name):
         self._project = project
         self._name = name
         self._dir = os.path.join(self._project.getConfig(['dirs', 'layouts']),
                                  name)
-        self._other_files = []
+        self._other_files = None
 
         self._files = {}
         self._files["template"] = os.path.join(self._dir, 'template.html')
@@ -98,43 +338,66 @@ class Layout:
         self._files["end"] = os.path.join(self._dir, 'blog', 'end.html')
         self._files["singleentry"] = os.path.join(self._dir, 'blog', 'singleentry.html')
 
+        # Templates are read when they are used for the first time
+        # Key: name
+        # Value: Template
         self._templates = {}
-
-        print("Found layout: " + self._name)
-
-        # Check if template files exist and read them
-        for i in self._files:
-            try:
-                self._templates[i] = open(self._files[i]).read()
-            except IOError as e:
-                fail("Error reading \"" + self._files[i] + "\": " + str(e))
-
-        # Search other files (CSS, images, ...)
-        for f in findFiles(self._dir, [".html"]):
-            print("\tFound file: " + f)
-            self._other_files.append(OtherFile(self._dir,
-                                               os.path.relpath(f, self._dir)))
-
-    def copy(self, dest, site):
-        for f in self._other_files:
-            f.copy(site, os.path.join(dest, self.getSubdir()))
+        self._lock = threading.Lock()
+
+        log.debug("Found layout: " + self._name)
+
+    def copy(self, dest, site, jobs):
+        other_files = self._getOtherFiles()
+        site.count("assets", len(other_files))
+        for f in other_files:
+            jobs.run(f.copy, site, os.path.join(dest, self.getSubdir()))
+
+    def _getOtherFiles(self):
+        """ Other files (CSS, images, ...) """
+        with self._lock:
+            if self._other_files is None:
+                self._other_files = []
+                for f in findFiles(self._dir, [".html"]):
+                    log.debug("\tFound file: " + f)
+                    self._other_files.append(
+                        OtherFile(self._dir, os.path.relpath(f, self._dir)))
+            return self._other_files
+
+    def _getTemplate(self, name):
+        with self._lock:
+            template = self._templates.get(name)
+            if not template:
+                try:
+                    with open(self._files[name]) as f:
+                        template = Template(f.read())
+                except IOError as e:
+                    fail("Error reading \"" + self._files[name] + "\": " +
+                         str(e))
+                self._templates[name] = template
+            return template
 
     def getSubdir(self):
         return os.path.join("style", self._name)
 
+    def getStats(self):
+        return self._project.getStats()
+
+    def getTemplateFiles(self, names):
+        return [self._files[n] for n in names]
+
     def useTemplate(self, src, reps, user_reps, ext=None):
-        content = self._translateMarkup(src, ext)
+        content = self.translateMarkup(src, ext)
         text = self._prepareTemplate("template", user_reps, reps, content)
         return (text, content)
 
-    def useBlogEntry(self, src, reps, user_reps):
-        return self._prepareTemplate("entry", user_reps, reps, self._translateMarkup(src))
+    def useBlogEntry(self, content, reps, user_reps):
+        return self._prepareTemplate("entry", user_reps, reps, content)
 
     def useBlogSeparator(self, user_reps):
         return self._prepareTemplate("separator", user_reps, [], "")
 
-    def useBlogSingleEntry(self, src, reps, user_reps):
-        return self._prepareTemplate("singleentry", user_reps, reps, self._translateMarkup(src))
+    def useBlogSingleEntry(self, content, reps, user_reps):
+        return self._prepareTemplate("singleentry", user_reps, reps, content)
 
     def useBlogBegin(self, reps, user_reps):
         return self._prepareTemplate("begin", user_reps, reps, "")
@@ -142,22 +405,15 @@ class Layout:
     def useBlogEnd(self, reps, user_reps):
         return self._prepareTemplate("end", user_reps, reps, "")
 
-    def useBlogRSSEntry(self, src, reps, user_reps):
-        text = self._removeHTML(self._translateMarkup(src))
+    def useBlogRSSEntry(self, content, reps, user_reps):
+        text = self._removeHTML(content)
         text = self.replaceKeywords(text, self._transformUserReps(user_reps))
         return self.replaceKeywords(text, reps)
 
-    def createOutput(self, dest, text):  # TODO: move to helper.py?, use for other files too?
-        mkdir(os.path.dirname(dest))
-
-        try:
-            outf = open(dest, 'w')
-            outf.write(text)
-            outf.close()
-        except IOError as e: #TODO: check exceptions
-            fail("Error creating " + dest + ": " + str(e))
+    def createOutput(self, dest, text):
+        self._project.getWriter().write(dest, text)
 
-    def _translateMarkup(self, src, ext=None):
+    def translateMarkup(self, src, ext=None):
         text = ''
 
         # src is string -> file extension given
@@ -173,42 +429,35 @@ class Layout:
 
             ext = os.path.splitext(src)[1]
 
-        config = self._project.getConfig(["markup"], False)
-        if not config:
-            return text
-
-        tool = config.get(ext)
-
-        if tool:
-            try:
-                p = Popen(tool, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            except PermissionError as e:
-                fail(' '.join(tool) + ": " + str(e))
-            except FileNotFoundError as e:
-                fail(' '.join(tool) + ": " + str(e))
-            out, err = p.communicate(text.encode())
-            if p.returncode:
-                fail(' '.join(tool) + ": " + err.decode())
-            if len(err):
-                print("Warning from " + ' '.join(tool) + ": " + err.decode())
-            return out.decode()
+        converter = self._project.getConverter(ext)
+
+        if converter:
+            stats = self.getStats()
+            cache = self._project.getCache()
+            if cache:
+                result = cache.get(text, ext, converter.getKey())
+                if result is not None:
+                    stats.addTool(' '.join(converter.getKey()), 0, True)
+                    return result
+
+            start = time.perf_counter()
+            result = converter.convert(text)
+            seconds = time.perf_counter() - start
+            stats.add("markup", seconds)
+            stats.addTool(' '.join(converter.getKey()), seconds)
+            if cache:
+                cache.put(text, ext, converter.getKey(), result)
+            return result
         return text
 
     def replaceKeywords(self, text, reps):
-        if not reps:
-            return text
-
-        trans = lambda m: reps[m.group(0)]
-        rc = re.compile('|'.join(map(re.escape, reps)))
-        return rc.sub(trans, text)
+        return replaceKeywords(text, reps)
 
+    @timed("templates")
     def _prepareTemplate(self, name, user_reps, reps, content):
         # User reps -> content -> user reps -> reps
-        text = self._templates[name][:]
-        text = self.replaceKeywords(text, self._transformUserReps(user_reps))
-        text = text.replace("%CONTENT%", content)
-        text = self.replaceKeywords(text, self._transformUserReps(user_reps))
-        return self.replaceKeywords(text, reps)
+        return self._getTemplate(name).render(
+            self._transformUserReps(user_reps), reps, content)
 
     def _removeHTML(self, text):
         return re.sub('<.*?>', '', text)
@@ -220,6 +469,27 @@ class Layout:
         return result
 
 
+class BuildContext:
+    """ Everything that is the same for all pages of a site in one build """
+    __slots__ = ["_time", "_reps"]
+
+    def __init__(self, site, time):
+        self._time = time
+        self._reps = {"%SITETITLE%": site.getSiteTitle(),
+                      "%SITESUBTITLE%": site.getSiteSubtitle(),
+                      "%VERSION%": version,
+                      "%GENERATIONTIME%": time.strftime(site.getConfig(["timeformat"], False, "%c")),
+                      "%GENERATIONYEAR%": time.strftime("%Y"),
+                      "%URL%": site.getConfig(["url"], False, "")}
+
+    def getTime(self):
+        return self._time
+
+    def getReps(self):
+        """ Reps of all pages, don't change them """
+        return self._reps
+
+
 class Site:
     def __init__(self, name, project):
         self._project = project
@@ -228,8 +498,18 @@ class Site:
         self._other_files = []
         self._config = self._project._config
         self._layouts = []
-        self._file_index = []
-        print("Found site: " + self._name)
+        self._file_index = set()
+        self._file_index_lock = threading.Lock()
+        self._manifest = None
+        self._menu = None
+        self._menu_lock = threading.Lock()
+        self._abs_src = os.path.abspath(self.getAbsSrcPath())
+
+        # Key: "pages", "assets", "blog entries", ...
+        # Value: number of them
+        self._counts = Counter()
+        self._context = None
+        log.debug("Found site: " + self._name)
 
     def getConfig(self, key, fail=True, default=None):
         return self._config.get(key, fail, default)
@@ -240,12 +520,29 @@ class Site:
     def getAbsDestPath(self):
         return os.path.join(self._project.getOutputDir(), self._name)
 
+    def getRelPath(self, path):
+        """ Path relative to the source directory of this site """
+        if not path:
+            return ""
+        if not path.startswith(self._abs_src + os.sep):
+            path = os.path.abspath(path)
+        return path[len(self._abs_src)+1:]
+
+    def getClassifier(self):
+        return self._config.getClassifier()
+
     def getProject(self):
         return self._project
 
+    def getStats(self):
+        return self._project.getStats()
+
     def getRoot(self):
         return self._root
 
+    def getContext(self):
+        return self._context
+
     def getSiteTitle(self):
         return self.getConfig(["title"], False, self._name)
 
@@ -253,64 +550,86 @@ class Site:
         return self.getConfig(["subtitle"], False, "")
 
     def read(self):
-        # read site specific config
-        filename = os.path.join(self.getConfig(["dirs", "sites"]),
-                                self._name + ".json")
-        if not os.path.isfile(filename):
-            fail("Can't find config file: " + filename)
-        site_config = Config(filename, Config.site_struct)
-        self._config = Config.merge(self._config, site_config, True)
-
-        # create file index
-        path = self.getAbsDestPath()
-        if os.path.isdir(path):
-            self._file_index = findFiles(path)
-
-        # read all pages
-        self._readHelper(self.getAbsSrcPath(), self._root)
-
-    def copy(self):
-        print("Create site: " + self._name)
+        with self.getStats().phase("config"):
+            # read site specific config
+            filename = os.path.join(self.getConfig(["dirs", "sites"]),
+                                    self._name + ".json")
+            if not os.path.isfile(filename):
+                fail("Can't find config file: " + filename)
+            site_config = Config(filename, Config.site_struct)
+            self._config = Config.merge(self._config, site_config, True)
+            self._context = BuildContext(self, self._project.getBuildTime())
+
+            # read manifest of last build
+            if self._project.isIncremental():
+                self._manifest = self._project.getManifest(self._name)
+
+        with self.getStats().phase("scan"):
+            # create file index
+            path = self.getAbsDestPath()
+            if os.path.isdir(path):
+                self._file_index = set(e.path for e in walkFiles(path))
+
+            # read all pages
+            self._readHelper(self.getAbsSrcPath(), self._root)
+
+    def copy(self, jobs):
+        log.info("Create site: " + self._name)
 
         # Pages
-        self._root.copy()
+        self._root.copy(jobs)
 
         # Layouts
         for l in self._layouts:
-            l.copy(self.getAbsDestPath(), self)
+            l.copy(self.getAbsDestPath(), self, jobs)
 
         # Other files
         for f in self._other_files:
-            f.copy(self)
+            jobs.run(f.copy, self)
+
+        jobs.wait()
+        self._project.getWriter().wait()
+
+        if self._manifest:
+            self._manifest.save()
 
-        # Cleanup
+        self._cleanup()
+
+        log.info("\t" + self._getSummary())
+
+    def count(self, name, n=1):
+        """ Count pages, assets, ... for the summary """
+        self._counts[name] += n
+
+    def _getSummary(self):
+        parts = []
+        for name in ["pages", "assets", "blog entries", "old files removed",
+                     "old files"]:
+            if self._counts[name] or name in ["pages", "assets"]:
+                parts.append("{:,} {}".format(self._counts[name], name))
+        return ", ".join(parts)
+
+    @timed("cleanup")
+    def _cleanup(self):
         if self.getConfig(["delete-old"], False, 0):
             # remove files contained in the index
-            for f in self._file_index:
-                print("\tRemove old file: " + f)
+            for f in sorted(self._file_index):
+                log.debug("\tRemove old file: " + f)
                 try:
                     os.remove(f)
+                    self.count("old files removed")
+                    self._project.addChangedFile(f)
                 except OSError as e:
-                    print("\tError: " + str(e))
+                    log.warning("\tError: " + str(e))
 
             # Delete empty directories
-            while True:
-                deleted = False
-                for d in findDirs(self.getAbsDestPath()):
-                    if not os.listdir(d):
-                        deleted = True
-                        print("\tRemove empty directory: " + d)
-                        try:
-                            os.rmdir(d)
-                        except OSError as e:
-                            print("\tError: " + str(e))
-                if not deleted:
-                    break
+            removeEmptyDirs(self.getAbsDestPath())
         elif len(self._file_index) != 0:
             # Print old files
-            print("This are old files:")
-            for f in self._file_index:
-                print("\t" + f)
+            self.count("old files", len(self._file_index))
+            log.debug("This are old files:")
+            for f in sorted(self._file_index):
+                log.debug("\t" + f)
 
     def _readHelper(self, dir_path, parent, dir_hidden=False, blog_data_dir=False, page_config=None):
         index_rename = None
@@ -323,8 +642,12 @@ class Site:
         else:
             page_config = self._config
 
-        entries = sorted(os.listdir(dir_path))
+        # Key: filename
+        # Value: os.DirEntry
+        dir_entries = dict((e.name, e) for e in scanDir(dir_path))
+        entries = list(dir_entries)
         blog = None
+        blog_dir = None
 
         idx = None
         if not blog_data_dir:
@@ -341,12 +664,13 @@ class Site:
             # Create blog, if there is config for it
             if page_config.get(["blog"], False):
                 blog = Blog(dir_path, page_config, self)
+                blog_dir = os.path.normpath(blog.getAbsDir())
 
             # First we have to find the index file in this directory…
             idx = None
             for f in entries:
                 absf = os.path.join(dir_path, f)
-                if isFile(absf) and isCont(absf, self) and isIndex(absf, self):
+                if dir_entries[f].is_file() and isCont(absf, self) and isIndex(absf, self):
                     if index_rename:
                         page_config.add(["files", "rename", f], index_rename)
                     idx = Page(os.path.split(dir_path)[1], absf, self, parent,
@@ -362,6 +686,7 @@ class Site:
                 idx = Page(dirname, None, self, parent, dir_hidden or
                            isHidden(dirname, self, page_config), blog, page_config)
 
+            self.count("pages")
             if parent:
                 parent.appendPage(idx)
             else:
@@ -372,7 +697,7 @@ class Site:
             for s in reversed(sorted_entries):
                 absf = os.path.join(dir_path, s)
                 if not s in entries:
-                    print("\tFile not found (specified in sort): " + absf)
+                    log.warning("\tFile not found (specified in sort): " + absf)
                 else:
                     entries.remove(s)
                     entries.insert(0, s)
@@ -383,18 +708,19 @@ class Site:
             if isExcluded(absf, self, page_config):
                 continue
             hidden = dir_hidden or isHidden(absf, self, page_config)
-            new_blog_data_dir = blog_data_dir or (blog and os.path.samefile(absf, blog.getAbsDir()))
+            new_blog_data_dir = blog_data_dir or absf == blog_dir
 
             # Content file -> Page
-            if isFile(absf) and isCont(absf, self):
+            if dir_entries[f].is_file() and isCont(absf, self):
                 if new_blog_data_dir:
                     continue
-                print("\tFound page: " + absf)
+                log.debug("\tFound page: " + absf)
+                self.count("pages")
                 idx.appendPage(Page(os.path.splitext(f)[0], absf, self, idx,
                                     hidden, blog, page_config))
             # Directory -> Go inside
-            elif os.path.isdir(absf):
-                print("\tFound dir:  " + absf)
+            elif dir_entries[f].is_dir():
+                log.debug("\tFound dir:  " + absf)
                 self._readHelper(absf, idx, hidden, new_blog_data_dir, page_config.copy())
             # Unknown object
             else:
@@ -402,39 +728,141 @@ class Site:
                                 os.path.relpath(absf, self.getAbsSrcPath()),
                                 self.getAbsDestPath())
                 self._other_files.append(tmp)
-                print("\tFound unkown object: " + absf)
+                self.count("assets")
+                log.debug("\tFound unkown object: " + absf)
 
+    @timed("menu")
     def createMenu(self, cur_page):
-        return self._root.createMenu(cur_page)
+        with self._menu_lock:
+            if self._menu is None:
+                self._menu = {}
+                self._readMenu(self._root,
+                               [self._root] + self._root.getSubpages())
+
+        # All pages from cur_page to the root are active
+        path = set()
+        parent = cur_page
+        while parent:
+            path.add(parent)
+            parent = parent.getParent()
+
+        return self._createMenuHelper(self._root, cur_page, path,
+                                      cur_page.getRootLink(), False)
+
+    def _readMenu(self, page, items):
+        """ Collect everything about the menu items that does not depend on
+        the current page """
+        # Key: page
+        # Value: list of (page, path from root, inactive HTML, active HTML)
+        self._menu[page] = []
+        for p in items:
+            title = p.getShortTitle()
+            path = p.getLink(self._root)
+            if path == "./":
+                path = ""
+            self._menu[page].append((p, path,
+                                     "\">" + title + "</a></li>\n",
+                                     "\" class=\"active\">" + title +
+                                     "</a></li>\n"))
+            if not p.isRoot():
+                self._readMenu(p, p.getSubpages())
+
+    def _createMenuHelper(self, level, cur_page, path, root_link, last):
+        # Create HTML Code
+        found = False
+        tmp = []
+        for p, rel_path, inactive, active in self._menu[level]:
+            if p is cur_page:
+                found = True
+
+            if p.isHidden():
+                continue
+
+            link = root_link + rel_path or "./"
+            if p in path and (not p.isRoot() or p is cur_page):
+                tmp.extend(["<li><a href=\"", link, active])
+            else:
+                tmp.extend(["<li><a href=\"", link, inactive])
+
+            # Create submenu
+            if not p.isRoot() and p in path and not last:
+                tmp.append(self._createMenuHelper(p, cur_page, path,
+                                                  root_link, found))
+
+        return "<ul>\n" + "".join(tmp) + "</ul>\n" if tmp else ""
+
+    def isIncremental(self):
+        return self._manifest is not None
+
+    def isUpToDate(self, dest, inputs, values=None):
+        if not self._manifest:
+            return False
+        return self._manifest.isUpToDate(dest, inputs, values)
+
+    def recordOutput(self, dest, inputs, values=None):
+        if self._manifest:
+            self._manifest.record(dest, inputs, values)
 
     def delFromFileIndex(self, path):
-        if path in self._file_index:
-            self._file_index.remove(path)
+        with self._file_index_lock:
+            self._file_index.discard(path)
 
 
 class Page:
+    # Large sites have many pages, so they don't get a __dict__
+    __slots__ = ["_name", "_absSrc", "_site", "_hidden", "_parent",
+                 "_subpages", "_blog", "_config", "_content", "_dep_inputs",
+                 "_dep_values", "_index", "_depth", "_path", "_dest",
+                 "_title"]
+
     def __init__(self, name, absPath, site, parent, hidden, blog, config):
-        self._name = name
+        self._name = sys.intern(name)
         self._absSrc = absPath
         self._site = site
         self._hidden = hidden
         self._parent = parent
-        self._subpages = []
+        self._subpages = ()
         self._blog = blog
         self._config = config
         self._content = None
+        self._dep_inputs = ()
+        self._dep_values = ()
+        self._index = isIndex(absPath, site)
+
+        # Number of parents, path relative to the root page (e.g. "a/b/")
+        # and title with the titles of all parents (without "Home")
+        if parent:
+            self._depth = parent._depth + 1
+            self._path = parent._path + self._name + "/"
+            self._title = parent._title + " > " + self.getShortTitle()
+        else:
+            self._depth = 0
+            self._path = ""
+            self._title = site.getSiteTitle()
+        self._dest = os.path.join(site.getAbsDestPath(), self._path,
+                                  "index.html")
 
-        self._site.delFromFileIndex(self._getDestFile())
+        self._site.delFromFileIndex(self._dest)
 
-        if self._blog and isIndex(self._absSrc, self._site):
+        if self._blog and self._index:
             self._blog.setIndexPage(self)
 
     def setContent(self, content, extension):
         self._content = (content, extension)
 
+    def setDependencies(self, inputs, values):
+        """ Additional inputs of generated pages (for incremental builds) """
+        self._dep_inputs = inputs
+        self._dep_values = values
+
     def appendPage(self, p):
+        if not self._subpages:
+            self._subpages = []
         self._subpages.append(p)
 
+    def getSubpages(self):
+        return self._subpages
+
     def getParent(self):
         return self._parent
 
@@ -452,83 +880,105 @@ class Page:
         return self._site.getProject().getLayout(layout)
 
     def getReps(self):
-        return {"%ROOT%": self.getRootLink(),
+        reps = {"%ROOT%": self.getRootLink(),
                 "%CUR%": self.getCurrentLink(),
                 "%LAYOUT%": self.getLayoutDir(),
                 "%TITLE%": self.getTitle(),
-                "%SITETITLE%": self._site.getSiteTitle(),
-                "%SITESUBTITLE%": self._site.getSiteSubtitle(),
-                "%MENU%": self._site.createMenu(self),
-                "%VERSION%": version,
-                "%GENERATIONTIME%": datetime.now().strftime(self._config.get(["timeformat"], False, "%c")),
-                "%GENERATIONYEAR%": datetime.now().strftime("%Y"),
-                "%URL%": self._config.get(["url"], False, "")}
-
-    def copy(self):
-        user_reps = self._config.get(["variables"], False, [])
-
-        # regular file
-        output = ""
-        content = ""
-        if not self._content:
-            output, content = self.getLayout().useTemplate(self._absSrc, self.getReps(), user_reps)
-        else:
-            output, content = self.getLayout().useTemplate(self._content[0], self.getReps(), user_reps, self._content[1])
+                "%MENU%": self._site.createMenu(self)}
+        reps.update(self._site.getContext().getReps())
+        return reps
 
-        if self._blog:
-            output = self._blog.getPageOne(self, output)
-            self._blog.createPages(self, content)
+    def isUpToDate(self, reps=None):
+        """ reps are the reps of this page, if they are already known """
+        # Without a manifest the menu is not rendered just to find that out
+        if not self._site.isIncremental():
+            return False
+        return self._site.isUpToDate(self._getDestFile(), self._getInputs(),
+                                     self._getValues(reps or self.getReps()))
 
-        self.getLayout().createOutput(self._getDestFile(), output)
+    def copy(self, jobs):
+        """ Create this page and all subpages """
+        jobs.run(self.create, jobs)
 
         # Copy subpages
         for p in self._subpages:
-            p.copy()
+            p.copy(jobs)
 
         # Copy blog
-        if self._blog and isIndex(self._absSrc, self._site):
-            self._blog.copy()
+        if self._blog and self._index:
+            self._blog.copy(jobs)
 
-    def _getDestFile(self):
-        tmp_path = ""
+    def create(self, jobs, reps=None):
+        """ Create only this page, reps are the reps of this page if they are
+        already known """
+        start = time.perf_counter()
+        user_reps = self._config.get(["variables"], False, [])
+        reps = reps or self.getReps()
+        dest = self._getDestFile()
+        inputs = self._getInputs()
+        values = self._getValues(reps)
 
-        parent = self.getParent()
-        while parent and not parent.isRoot():
-            tmp_path = os.path.join(parent.getName(), tmp_path)
-            parent = parent.getParent()
+        # regular file
+        content = None
+        if not self._site.isUpToDate(dest, inputs, values):
+            output, content = self.useTemplate(reps, user_reps)
 
-        if not self.isRoot():
-            tmp_path = os.path.join(tmp_path, self.getName())
+            if self._blog:
+                output = self._blog.getPageOne(self, output, reps)
 
-        return os.path.join(self._site.getAbsDestPath(), tmp_path, "index.html")
+            self.getLayout().createOutput(dest, output)
+            self._site.recordOutput(dest, inputs, values)
 
-    def getRootLink(self):
-        tmp = ""
+        self._site.getStats().addPage(dest, time.perf_counter() - start)
 
-        parent = self.getParent()
-        while parent:
-            tmp = tmp + "../"
-            parent = parent.getParent()
+        if self._blog:
+            self._blog.createPages(self, content, jobs)
 
-        return tmp
+    def useTemplate(self, reps, user_reps):
+        if not self._content:
+            return self.getLayout().useTemplate(self._absSrc, reps, user_reps)
+        else:
+            return self.getLayout().useTemplate(self._content[0], reps, user_reps, self._content[1])
+
+    def _getInputs(self):
+        inputs = [self._absSrc]
+        inputs.extend(self.getLayout().getTemplateFiles(["template"]))
+        inputs.extend(self._config.getFiles())
+        inputs.extend(self._dep_inputs)
+        if self._blog:
+            inputs.extend(self._blog.getInputs(1))
+        return inputs
+
+    def _getValues(self, reps):
+        # The generation time changes on every run, so it is not a reason
+        # to create the page again
+        values = dict(reps)
+        del values["%GENERATIONTIME%"]
+        del values["%GENERATIONYEAR%"]
+        result = [values, self._dep_values]
+        # The page list of the blog changes with the number of pages
+        if self._blog:
+            result.append(self._blog._getCommonReps(1, True))
+        return result
+
+    def _getDestFile(self):
+        return self._dest
+
+    def getRootLink(self):
+        return "../" * self._depth
 
     def getCurrentLink(self):
-        return '' if self._absSrc and isIndex(self._absSrc, self._site) else '../'
+        return '' if self._index else '../'
 
     def getLayoutDir(self):
         return self.getRootLink() + self.getLayout().getSubdir() + "/"
 
     def getLink(self, origin=None):
-        tmp = ""
-        parent = self
-        while parent and not parent.isRoot():
-            tmp = parent.getName() + "/" + tmp
-            parent = parent.getParent()
-
+        """ Relative link from origin (default: this page) to this page """
         if not origin:
             origin = self
 
-        tmp = origin.getRootLink() + tmp
+        tmp = origin.getRootLink() + self._path
 
         if tmp == "":
             tmp = "./"
@@ -550,56 +1000,15 @@ class Page:
             return cleverCapitalize(self.getName())
 
     def getTitle(self, no_home=False):
-        if not self.getParent():
-            if no_home:
-                return self._site.getSiteTitle()
-            else:
-                return self._site.getSiteTitle() + " > " + self.getShortTitle()
-        else:
-            return self.getParent().getTitle(True) + " > " + self.getShortTitle()
-
-    def createMenu(self, cur_page, last=False):
-        items = self._subpages[:]
-
-        # Add root link
-        if self.isRoot():
-            items.insert(0, self)
-
-        # Create HTML Code
-        found = False
-        tmp = ""
-        for p in items:
-            if p == cur_page:
-                found = True
-
-            if p.isHidden():
-                continue
-
-            active = ""
-            if p._pageIsInPathTo(cur_page) and (not p.isRoot() or p == cur_page):
-                active = " class=\"active\""
-
-            tmp = ''.join([tmp, "<li><a href=\"", p.getLink(cur_page), "\"",
-                          active, ">", p.getShortTitle(), "</a></li>\n"])
-
-            # Create submenu
-            if not p.isRoot() and p._pageIsInPathTo(cur_page) and not last:
-                tmp += p.createMenu(cur_page, found)
-
-        return "<ul>\n" + tmp + "</ul>\n" if tmp else ""
-
-    def _pageIsInPathTo(self, dest):
-        parent = dest
-        while parent:
-            if parent == self:
-                return True
-            parent = parent.getParent()
-
-        return False
+        if not self.getParent() and not no_home:
+            return self._title + " > " + self.getShortTitle()
+        return self._title
 
 
 class OtherFile:
     """ Copy other file """
+    __slots__ = ["_src_path_root", "_src_path_rel", "_dest_dir"]
+
     def __init__(self, src_path_root, src_path_rel, dest_dir=None):
         """ src_path_root / src_path_rel ==> dest_dir / src_path_rel """
         self._src_path_root = src_path_root
@@ -607,19 +1016,29 @@ class OtherFile:
         self._dest_dir = dest_dir
 
     def copy(self, site, to=None):
+        with site.getStats().phase("copy"):
+            self._copy(site, to)
+
+    def _copy(self, site, to):
         if not to:
             to = self._dest_dir
 
         out_file = os.path.join(to, self._src_path_rel)
-        out_dir = os.path.dirname(out_file)
-        mkdir(out_dir)
-
         site.delFromFileIndex(out_file)
-        shutil.copyfile(os.path.join(self._src_path_root, self._src_path_rel),
-                        os.path.join(out_dir,
-                                     os.path.basename(self._src_path_rel)))
+        src = os.path.join(self._src_path_root, self._src_path_rel)
+        if site.isUpToDate(out_file, [src]):
+            return
+
+        method = site.getConfig(["copy", "method"], False, "copy")
+        if not isCopy(src, out_file, site.getConfig(["copy", "check"], False, "mtime"), method):
+            site.getProject().getWriter().copy(src, out_file, method)
+        site.recordOutput(out_file, [src])
 
 class Blog:
+    __slots__ = ["_dir", "_config", "_site", "_index_page", "_entries",
+                 "_keys", "_per_page", "_number_of_pages", "_link_items",
+                 "_html", "_html_locks", "_lock"]
+
     def __init__(self, dir, config, site):
         self._dir = dir
         self._config = config
@@ -630,8 +1049,28 @@ class Blog:
         # Value: (title, filename)
         self._entries = {}
 
+        # Keys of all entries, newest first
+        self._keys = []
+
+        # Converted entries, every entry is converted only once per build
+        # Key: datetime object
+        # Value: HTML
+        self._html = {}
+        self._html_locks = {}
+        self._lock = threading.Lock()
+
         self._read()
 
+        self._per_page = self._config.get(["blog", "per-page"], False, 0)
+        self._number_of_pages = 0
+        if self._per_page != 0:
+            self._number_of_pages = math.ceil(len(self._keys) / self._per_page)
+
+        # Links to all pages for the page list, created on first use
+        # Key: root
+        # Value: list with one link per page
+        self._link_items = {}
+
     def setIndexPage(self, index):
         self._index_page = index
 
@@ -645,69 +1084,117 @@ class Blog:
         layout = self._config.get(["layout"], False)
         return self._site.getProject().getLayout(layout)
 
-    def getPageOne(self, page_obj, template):
-        tmp = self._getHTML(page_obj, 1, True)
+    def getStats(self):
+        return self._site.getStats()
+
+    def getPageOne(self, page_obj, template, page_reps=None):
+        tmp = self._getHTML(page_obj, 1, True, page_reps)
         if not tmp:
             tmp = ""
         return template.replace("%BLOG%", tmp)
 
-    def createPages(self, parent_page, template):
-        if self._config.get(["blog", "per-page"], False, 0) == 0:
+    @timed("blog")
+    def createPages(self, parent_page, template, jobs):
+        """ template is None if the parent page was not created again """
+        if self._per_page == 0:
             return
 
-        page_number = 1
-        while True:
+        pages = []
+        for page_number in range(1, self._number_of_pages + 1):
             page = Page(str(page_number), None, self._site, parent_page, True, None, self._config)
-            tmp = self._getHTML(page, page_number, False)
-            if not tmp:
-                return
-            content = template.replace("%BLOG%", tmp)
-            page.setContent(content, "html")
-            page.copy()
-            page_number += 1
-
-    def copy(self):
+            page.setDependencies([parent_page._absSrc] + self.getInputs(page_number),
+                                 [self._getCommonReps(page_number, False)])
+            # Only needed here for incremental builds, otherwise they are
+            # created in the job
+            reps = page.getReps() if self._site.isIncremental() else None
+            if not page.isUpToDate(reps):
+                pages.append((page_number, page, reps))
+
+        if pages and template is None:
+            user_reps = self._config.get(["variables"], False, [])
+            template = parent_page.useTemplate(parent_page.getReps(), user_reps)[1]
+
+        for page_number, page, reps in pages:
+            jobs.run(self._createPage, page, page_number, template, reps, jobs)
+
+    @timed("blog")
+    def _createPage(self, page, page_number, template, reps, jobs):
+        reps = reps or page.getReps()
+        content = template.replace("%BLOG%", self._getHTML(page, page_number, False, reps))
+        page.setContent(content, "html")
+        page.create(jobs, reps)
+
+    def copy(self, jobs):
+        for i in self._keys:
+            jobs.run(self._createSingleEntry, i, jobs)
+
+        jobs.run(self._createRSS)
+
+    def _createSingleEntry(self, key, jobs):
         user_reps = self._config.get(["variables"], False, [])
-        for i in sorted(self._entries, reverse=True):
-            page = Page(self._getTitle(i), None, self._site, self._index_page, True, None, self._config)
-            content = self.getLayout().useBlogSingleEntry(self._entries[i][1], self._getEntryReps(i, page), user_reps)
-            page.setContent(content, "md")
-            page.copy()
+        page = Page(self._getTitle(key), None, self._site, self._index_page, True, None, self._config)
+        page.setDependencies([self._entries[key][1]] +
+                             self.getLayout().getTemplateFiles(["singleentry"]),
+                             [])
+        reps = page.getReps()
+        if page.isUpToDate(reps):
+            return
 
-        self._createRSS()
+        content = self.getLayout().useBlogSingleEntry(self._getEntryHTML(key), self._getEntryReps(key, page, False, reps), user_reps)
+        page.setContent(content, "md")
+        page.create(jobs, reps)
+
+    def getInputs(self, page):
+        """ Files used for the blog part of the given page """
+        inputs = self.getLayout().getTemplateFiles(["begin", "entry",
+                                                    "separator", "end"])
+        inputs.extend(self._entries[i][1] for i in self._getKeys(page))
+        return inputs
+
+    def _getKeys(self, page):
+        """ Keys of the entries on the given page """
+        if self._per_page == 0:
+            return self._keys
+        return self._keys[(page-1)*self._per_page:page*self._per_page]
 
     def _getLinks(self, page, root=False):
-        per_page = self._config.get(["blog", "per-page"], False, 0)
         max_pages = self._config.get(["blog", "max-pages"], False, 0)
-        if per_page == 0:
+        if self._per_page == 0:
             return ""
 
         link = ""
         if not root:
             link = "../"
 
-        number_of_pages = math.ceil(len(self._entries) / per_page)
+        number_of_pages = self._number_of_pages
         start = 1
         end = number_of_pages
         if max_pages != 0:
             start = max(page - math.floor(max_pages / 2), 1)
             end = min(start + max_pages - 1, number_of_pages)
 
-        tmp = "<ul>\n"
-        for i in range(start, end+1):
-            if i == page:
-                tmp += "<li>" + str(i) + "</li>\n"
-            else:
-                tmp += "<li><a href=\"" + link + str(i) + "\">" + str(i) + "</a></li>\n"
-        tmp += "</ul>"
+        items = self._link_items.get(root)
+        if items is None:
+            items = ["<li><a href=\"" + link + str(i) + "\">" + str(i) + "</a></li>\n"
+                     for i in range(1, number_of_pages+1)]
+            self._link_items[root] = items
+
+        tmp = ["<ul>\n"]
+        if start <= page <= end:
+            tmp.extend(items[start-1:page-1])
+            tmp.append("<li>" + str(page) + "</li>\n")
+            tmp.extend(items[page:end])
+        else:
+            tmp.extend(items[start-1:end])
+        tmp.append("</ul>")
 
-        return tmp
+        return "".join(tmp)
 
     def _getDirectLink(self, page, root, configname, default, relative=0, first=False, last=False):
-        per_page = self._config.get(["blog", "per-page"], False, 0)
+        per_page = self._per_page
         if per_page == 0:
             return ""
-        number_of_pages = math.ceil(len(self._entries) / per_page)
+        number_of_pages = self._number_of_pages
 
         to_page = 1   # to first page
         if relative:  # relative to current page
@@ -724,41 +1211,55 @@ class Blog:
         else:
             return "<a href=\"" + link + str(to_page) + "\">" + self._config.get(["blog", configname], False, default) + "</a>"
 
-    def _getHTML(self, page_obj, page, root):
+    def _getHTML(self, page_obj, page, root, page_reps=None):
+        """ page_reps are the reps of page_obj, if they are already known """
         user_reps = self._config.get(["variables"], False, [])
-        per_page = self._config.get(["blog", "per-page"], False, 0)
 
-        start = (page-1)*per_page
-        end = page*per_page-1
-
-        if start >= len(self._entries) or (per_page == 0 and page != 1):  # No entries for this page
+        keys = self._getKeys(page)
+        if not keys or (self._per_page == 0 and page != 1):  # No entries for this page
             return None
 
-        tmp = self.getLayout().useBlogBegin(self._getCommonReps(page, root), user_reps)
-        for n, i in enumerate(sorted(self._entries, reverse=True)):
-            if (n < start or n > end) and per_page != 0:
-                continue
+        layout = self.getLayout()
+        common_reps = self._getCommonReps(page, root)
+        page_reps = page_reps or page_obj.getReps()
+        if len(keys) > 1:
+            separator = layout.useBlogSeparator(user_reps)
 
-            tmp += self.getLayout().useBlogEntry(self._entries[i][1], self._getEntryReps(i, page_obj), user_reps)
-            if n != end and n != len(self._entries)-1:  # Last element on page or last element of all entries
-                tmp += self.getLayout().useBlogSeparator(user_reps)
-        tmp += self.getLayout().useBlogEnd(self._getCommonReps(page, root), user_reps)
+        tmp = [layout.useBlogBegin(common_reps, user_reps)]
+        for n, i in enumerate(keys):
+            if n != 0:
+                tmp.append(separator)
+            tmp.append(layout.useBlogEntry(self._getEntryHTML(i), self._getEntryReps(i, page_obj, False, page_reps), user_reps))
+        tmp.append(layout.useBlogEnd(common_reps, user_reps))
 
-        return tmp
+        return "".join(tmp)
 
     def _read(self):
-        for f in findFiles(self.getAbsDir()):
+        for e in walkFiles(self.getAbsDir()):
+            f = e.path
             if isCont(f, self._site):
                 # meta = (time, title)
                 meta = self._getMeta(f)
                 if meta:
-                    print("\tFound blog entry: " + f)
+                    log.debug("\tFound blog entry: " + f)
                     self._entries[meta[0]] = (meta[1], f)
+                    self._site.count("blog entries")
                 else:
-                    print("\tWarning: content file with invalid filename for blog: " + f)
+                    log.warning("\tWarning: content file with invalid filename for blog: " + f)
             else:
                 pass # FIXME: OtherFile
 
+        self._keys = sorted(self._entries, reverse=True)
+
+    def _getEntryHTML(self, key):
+        with self._lock:
+            lock = self._html_locks.setdefault(key, threading.Lock())
+
+        with lock:
+            if key not in self._html:
+                self._html[key] = self.getLayout().translateMarkup(self._entries[key][1])
+            return self._html[key]
+
     def _getMeta(self, path):
         filename = os.path.basename(os.path.splitext(path)[0])
         data = re.match(r"([0-9]{4})-([0-9]{2})-([0-9]{2})-([0-9]{2})-([0-9]{2})-(.+)", filename)
@@ -781,11 +1282,12 @@ class Blog:
                 "%PAGEFIRST%": self._getDirectLink(page, root, "first", "&lt;&lt;", first=True),
                 "%PAGELAST%": self._getDirectLink(page, root, "last", "&gt;&gt;", last=True)}
 
-    def _getEntryReps(self, key, page_obj, full_link=False):
+    def _getEntryReps(self, key, page_obj, full_link=False, page_reps=None):
+        """ page_reps are the reps of page_obj, if they are already known """
         reps = {"%DATE%": key.strftime(self._config.get(["timeformat"], False, "%c")),
                 "%LINK%": self._getLinkTo(key, page_obj, full_link),
                 "%BLOGENTRYTITLE%": self._entries[key][0]}
-        reps.update(page_obj.getReps())
+        reps.update(page_reps or page_obj.getReps())
         reps["%CUR%"] = self._index_page.getLink(page_obj) + "/" + self.getDir() + "/" + os.path.relpath(os.path.dirname(self._entries[key][1]), self.getAbsDir()) + "/"
         return reps
 
@@ -795,21 +1297,36 @@ class Blog:
             tmp = self._config.get(["url"], False, "") + "/"
         return tmp + self._index_page.getLink(page_obj) + self._getTitle(key)
 
+    @timed("rss")
     def _createRSS(self):
         if not self._config.get(["blog", "rss"], False):
             return
 
         user_reps = self._config.get(["variables"], False, [])
         dest = os.path.join(self._site.getAbsDestPath(), self._config.get(["blog", "rss", "file"]))
-        with open(dest, "wt") as f:
-            locale_backup = locale.getlocale(locale.LC_ALL)
-            locale.setlocale(locale.LC_ALL, "en_GB")
+        self._site.delFromFileIndex(dest)
 
-            url = self._config.get(["url"], False)
-            if not url:
-                print("\tWarning: No URL given in configuration. Generating invalid RSS feed.")
-                url=""
+        # Only the newest entries
+        keys = self._keys
+        max_items = self._config.get(["blog", "rss", "max-items"], False, 0)
+        if max_items > 0:
+            keys = keys[:max_items]
 
+        inputs = [self._entries[i][1] for i in reversed(keys)]
+        inputs.extend(self._config.getFiles())
+        if self._site.isUpToDate(dest, inputs):
+            return
+
+        url = self._config.get(["url"], False)
+        if not url:
+            log.warning("\tWarning: No URL given in configuration. Generating invalid RSS feed.")
+            url=""
+
+        # Pages are written in the background, the directory may be missing
+        mkdir(os.path.dirname(dest))
+        # Entries are written one by one, the feed is never completely in memory
+        project = self._site.getProject()
+        with openAtomic(dest, project.isKeepUnchanged()) as f:
             f.write('<?xml version="1.0" encoding="utf-8"?>\n')
             f.write('<rss version="2.0">\n')
             f.write('<channel>\n')
@@ -822,14 +1339,15 @@ class Blog:
             if self._config.get(["blog", "rss", "show_generator"], False, True):
                 f.write('<generator>stawebg ' + self._RSSencode(version) + '</generator>\n')
 
-            f.write('<pubDate>' + self._getRSSDate(datetime.now()) + '</pubDate>\n')
+            f.write('<pubDate>' + self._getRSSDate(self._site.getContext().getTime()) + '</pubDate>\n')
 
-            for i in sorted(self._entries, reverse=True):
-                html=self.getLayout().useBlogRSSEntry(self._entries[i][1], self._getEntryReps(i, self._site.getRoot(), True), user_reps)
+            root_reps = self._site.getRoot().getReps()
+            for i in keys:
+                text = self.getLayout().useBlogRSSEntry(self._getEntryHTML(i), self._getEntryReps(i, self._site.getRoot(), True, root_reps), user_reps)
                 # FIXME: remove HTML
                 f.write('<item>\n')
-                f.write('<title>' + self._RSSencode(self._getRSSTitle(html)) + '</title>\n')
-                f.write('<description>' + self._RSSencode(self._getRSSContent(html)) + '</description>\n')
+                f.write('<title>' + self._RSSencode(self._getRSSTitle(text)) + '</title>\n')
+                f.write('<description>' + self._RSSencode(self._getRSSContent(text)) + '</description>\n')
                 f.write('<link>' + self._RSSencode(url + '/' + self._getLinkTo(i, self._site.getRoot())) + '</link>\n')
                 f.write('<guid>' + self._RSSencode(self._getTitle(i)) + '</guid>\n')
                 f.write('<pubDate>' + self._RSSencode(self._getRSSDate(i)) + '</pubDate>\n')
@@ -838,15 +1356,20 @@ class Blog:
             f.write('</channel>\n')
             f.write('</rss>\n')
 
-            locale.setlocale(locale.LC_ALL, locale_backup)
+        if f.isChanged():
+            project.addChangedFile(dest)
+        self._site.recordOutput(dest, inputs)
 
-        self._site.delFromFileIndex(dest)
 
     def _RSSencode(self, text):
-        return cgi.escape(text).encode('ascii', 'xmlcharrefreplace').decode('utf-8')
+        return html.escape(text, False).encode('ascii', 'xmlcharrefreplace').decode('utf-8')
 
     def _getRSSDate(self, data):
-        return data.strftime('%d %b %Y %H:%M') + " " + self._config.get(["timezone"],False, '+0000')
+        """ RFC 822 date, independent of the locale """
+        return "%02d %s %04d %02d:%02d %s" % (data.day, MONTHS[data.month-1],
+                                              data.year, data.hour,
+                                              data.minute,
+                                              self._config.get(["timezone"], False, '+0000'))
 
     def _getRSSGroups(self, text, group):
         #FIXME: ignore empty lines at begin (and at the end)
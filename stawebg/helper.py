@@ -1,63 +1,78 @@
 #!/usr/bin/python3
 
+import contextlib
 import errno
+import hashlib
+import locale
+import logging
+import logging.handlers
 import os
-import re
+import queue
+import shutil
 import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 #
 # File IO
 #
 
 
-def listFolders(path):
-    # Get absolute names of all files
-    files = os.listdir(path)
-
-    result = []
-
-    # Join paths and check if directory
-    for f in files:
-        absf = os.path.join(path, f)
-        if os.path.isdir(absf):
-            result.append(f)
+def scanDir(path):
+    """ Entries of path as os.DirEntry objects, sorted by name
 
-    return result
-
-
-def findFiles(path, exclude_ext=[]):
-    # Get absolute names of all files
+    The entries know if they are directories and cache their stat(), so
+    no extra system calls are needed for this.
+    """
     try:
-        files = os.listdir(path)
+        with os.scandir(path) as it:
+            return sorted(it, key=lambda e: e.name)
     except OSError as e:
         fail("Can't open directory: " + str(e))
 
-    result = []
 
-    # Join paths and go into directories
-    for f in files:
-        absf = os.path.join(path, f)
+def walkFiles(path, exclude_ext=()):
+    """ Yield os.DirEntry objects of all files below path """
+    exclude_ext = tuple(exclude_ext)
+    dirs = [path]
+
+    while dirs:
+        try:
+            with os.scandir(dirs.pop()) as it:
+                for e in it:
+                    if e.is_dir():
+                        dirs.append(e.path)
+                    elif not e.name.endswith(exclude_ext):
+                        yield e
+        except OSError as e:
+            fail("Can't open directory: " + str(e))
 
-        if os.path.isdir(absf):
-            result.extend(findFiles(absf, exclude_ext))
-        else:
-            if not absf.endswith(tuple(exclude_ext)):
-                result.append(absf)
 
-    return result
+def listFolders(path):
+    return [e.name for e in scanDir(path) if e.is_dir()]
 
 
-def findDirs(path):
-    dirs = listFolders(path)
+def findFiles(path, exclude_ext=()):
+    return [e.path for e in walkFiles(path, exclude_ext)]
 
-    result = []
 
-    for d in dirs:
-        tmp = os.path.join(path, d)
-        result.append(tmp)
-        result.extend(findDirs(tmp))
+def removeEmptyDirs(path):
+    """ Remove all empty directories below path in one bottom-up pass """
+    for d, dirs, files in os.walk(path, topdown=False):
+        if d == path or files:
+            continue
 
-    return result
+        # Subdirectories may have been removed in this pass
+        with os.scandir(d) as it:
+            if next(it, None) is not None:
+                continue
+
+        log.debug("\tRemove empty directory: " + d)
+        try:
+            os.rmdir(d)
+        except OSError as e:
+            log.warning("\tError: " + str(e))
 
 
 def mkdir(path):
@@ -68,6 +83,252 @@ def mkdir(path):
             fail(str(e))
 
 
+def fileHash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.digest()
+
+
+def isCopy(src, dest, check="mtime", method="copy"):
+    """ Check if dest is still an up to date copy of src
+
+    check is "mtime" (compare size and modification time), "hash" (compare
+    content) or "none" (always copy), method is the one given to copyFile
+    """
+    try:
+        src_stat = os.stat(src)
+        dest_stat = os.stat(dest)
+    except OSError:
+        return False
+
+    # Hard links are only up to date if we want them
+    if src_stat.st_ino == dest_stat.st_ino and \
+       src_stat.st_dev == dest_stat.st_dev:
+        return method == "hardlink"
+
+    if check == "none" or src_stat.st_size != dest_stat.st_size:
+        return False
+    elif check == "hash":
+        return fileHash(src) == fileHash(dest)
+    else:
+        return src_stat.st_mtime_ns == dest_stat.st_mtime_ns
+
+
+# ioctl to share the data blocks of two files (linux: btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+
+def copyFile(src, dest, method="copy"):
+    """ method is "copy", "hardlink" or "reflink"
+
+    Falls back to a normal copy if the file system does not support it.
+    """
+    if method == "hardlink":
+        try:
+            if os.path.lexists(dest):
+                os.remove(dest)
+            os.link(src, dest)
+            return
+        except OSError:
+            pass
+    elif method == "reflink":
+        # dest may be a hard link to src from an earlier build, so don't
+        # open it for writing
+        tmp = "%s.%d.%d.tmp" % (dest, os.getpid(), threading.get_ident())
+        try:
+            # Not available on every platform
+            import fcntl
+            with open(src, "rb") as s, open(tmp, "wb") as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            shutil.copystat(src, tmp)
+            os.replace(tmp, dest)
+            return
+        except (ImportError, OSError):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    if os.path.islink(dest) or (os.path.exists(dest) and
+                                os.stat(dest).st_nlink > 1):
+        # Don't change the source through a hard link of an earlier build
+        os.remove(dest)
+
+    shutil.copyfile(src, dest)
+    st = os.stat(src)
+    os.utime(dest, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def hasContent(path, size, digest):
+    """ Check if path has size bytes with the sha256 digest """
+    try:
+        if os.path.getsize(path) != size:
+            return False
+        return fileHash(path) == digest
+    except OSError:
+        return False
+
+
+class AtomicFile:
+    """ File opened by openAtomic(), write() takes strings or bytes """
+    def __init__(self, f):
+        self._file = f
+        self._encoding = locale.getpreferredencoding(False)
+        self._hash = hashlib.sha256()
+        self._size = 0
+        self._changed = True
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode(self._encoding)
+        self._hash.update(data)
+        self._size += len(data)
+        self._file.write(data)
+
+    def isChanged(self):
+        """ False if the file already had this content """
+        return self._changed
+
+
+@contextlib.contextmanager
+def openAtomic(path, keep_unchanged=False):
+    """ Open a temporary file for writing, it replaces path when it is closed
+
+    Nobody sees half written files. With keep_unchanged, path is not touched
+    if it already has the same content.
+    """
+    tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp, "wb") as f:
+            result = AtomicFile(f)
+            yield result
+
+        if keep_unchanged and \
+           hasContent(path, result._size, result._hash.digest()):
+            result._changed = False
+            os.remove(tmp)
+        else:
+            os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def writeFile(path, data):
+    with openAtomic(path) as f:
+        f.write(data)
+
+
+class Writer:
+    """ Write and copy files in background threads
+
+    write() and copy() block while queue_size files are waiting, so
+    creating pages can't get too far ahead of the disk. Every directory is
+    created only once. With keep_unchanged, files that already have the
+    right content are not touched.
+    """
+    def __init__(self, threads=2, queue_size=64, keep_unchanged=False):
+        self._queue = queue.Queue(queue_size)
+        self._keep_unchanged = keep_unchanged
+        self._encoding = locale.getpreferredencoding(False)
+        self._dirs = set()
+        self._dirs_lock = threading.Lock()
+        self._errors = []
+
+        # Files that were created or changed
+        self._changed = []
+
+        self._threads = [threading.Thread(target=self._work, daemon=True)
+                         for i in range(threads)]
+        for t in self._threads:
+            t.start()
+
+    def write(self, path, text):
+        self._queue.put((path, "Error creating " + path, self._writeText,
+                         (path, text)))
+
+    def copy(self, src, dest, method="copy"):
+        self._queue.put((dest, "Error copying " + src, self._copy,
+                         (src, dest, method)))
+
+    def getChanged(self):
+        return self._changed
+
+    def wait(self):
+        """ Wait until all files are written """
+        self._queue.join()
+        if self._errors:
+            errors = self._errors
+            self._errors = []
+            fail(os.linesep.join(errors))
+
+    def close(self):
+        for t in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+
+            dest, error, func, args = item
+            try:
+                self._makeDir(os.path.dirname(dest))
+                if func(*args):
+                    self._changed.append(dest)
+            except Exception as e:
+                # The thread must keep running, wait() reports the errors
+                self._errors.append(error + ": " + str(e))
+            finally:
+                self._queue.task_done()
+
+    def _writeText(self, path, text):
+        data = text.encode(self._encoding)
+        if self._keep_unchanged and \
+           hasContent(path, len(data), hashlib.sha256(data).digest()):
+            return False
+        writeFile(path, data)
+        return True
+
+    def _copy(self, src, dest, method):
+        if self._keep_unchanged:
+            try:
+                src_stat = os.stat(src)
+                dest_stat = os.stat(dest)
+            except OSError:
+                src_stat = dest_stat = None
+
+            # Hard links are copied again like in copyFile(), other files are
+            # only hashed if they have the same size
+            if dest_stat and dest_stat.st_nlink == 1 and \
+               src_stat.st_size == dest_stat.st_size and \
+               fileHash(src) == fileHash(dest):
+                # Take the modification time, so the next build doesn't
+                # compare them again
+                os.utime(dest, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+                return False
+
+        copyFile(src, dest, method)
+        return True
+
+    def _makeDir(self, path):
+        with self._dirs_lock:
+            if path in self._dirs:
+                return
+        os.makedirs(path, exist_ok=True)
+        with self._dirs_lock:
+            self._dirs.add(path)
+
+
 #
 # Strings and Regex
 #
@@ -84,21 +345,108 @@ def cutStr(text, length):
         return text
     return text[0:length-4] + "..."
 
-def matchList(string, regex_lst):
-    for r in regex_lst:
+#
+# Parallel execution
+#
+
+
+# JobQueue of the job that runs in this thread
+_current = threading.local()
+
+
+class JobQueue:
+    """ Run functions in a thread pool or directly if jobs is 1 """
+    def __init__(self, jobs=1):
+        self._executor = None
+        if jobs > 1:
+            self._executor = ThreadPoolExecutor(jobs)
+        self._futures = deque()
+        self._failed = False
+        self._failed_lock = threading.Lock()
+
+    def run(self, func, *args):
+        if self._executor:
+            if not self._failed:
+                self._futures.append(self._executor.submit(self._run, func,
+                                                           args))
+        else:
+            func(*args)
+
+    def setFailed(self):
+        """ Returns True for the first error """
+        with self._failed_lock:
+            first = not self._failed
+            self._failed = True
+            return first
+
+    def _run(self, func, args):
+        # Jobs that are still queued after an error don't run, so the error
+        # is printed only once
+        if self._failed:
+            return
+        _current.queue = self
+        try:
+            func(*args)
+        except BaseException:
+            self.setFailed()
+            raise
+        finally:
+            _current.queue = None
+
+    def wait(self):
+        # Jobs may add new jobs, so the queue can grow while we wait
         try:
-            if re.match(r, string):
-                return True
-        except re.error as e:
-            fail("Error in regular expression \"" + r + "\": " + str(e))
+            while self._futures:
+                self._futures.popleft().result()
+        except BaseException:
+            self._executor.shutdown(cancel_futures=True)
+            raise
 
-    return False
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown()
 
 #
 # Debug and errors
 #
 
+log = logging.getLogger("stawebg")
+
+# Messages are collected and written in blocks
+_log_handler = None
+
+
+def setupLog(level=logging.INFO, stream=None, capacity=1000):
+    """ Write messages of level and above to stream (default: stdout)
+
+    Messages are buffered until capacity messages are collected, a warning
+    is logged or flushLog() is called.
+    """
+    global _log_handler
+
+    if _log_handler:
+        log.removeHandler(_log_handler)
+        _log_handler.close()
+
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(logging.Formatter("%(message)s"))
+    _log_handler = logging.handlers.MemoryHandler(capacity, logging.WARNING,
+                                                  target)
+    log.addHandler(_log_handler)
+    log.setLevel(level)
+    log.propagate = False
+
+
+def flushLog():
+    if _log_handler:
+        _log_handler.flush()
+
 
 def fail(text):
-    sys.stderr.write(text + os.linesep)
+    # Jobs running at the same time often fail the same way, only the first
+    # error is printed
+    queue = getattr(_current, "queue", None)
+    if not queue or queue.setFailed():
+        flushLog()
+        sys.stderr.write(text + os.linesep)
     sys.exit(1)
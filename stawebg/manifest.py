@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import os
+import threading
+from stawebg.helper import log, mkdir
+
+
+class Manifest:
+    """ Remembers the inputs of all output files of the last build """
+    def __init__(self, path):
+        self._path = path
+        self._entries = {}
+        self._new_entries = {}
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+
+        if os.path.isfile(self._path):
+            try:
+                with open(self._path, "rt") as f:
+                    self._entries = json.load(f)
+            except (IOError, ValueError) as e:
+                log.warning("Warning: ignoring broken build manifest " +
+                            self._path + ": " + str(e))
+                self._entries = {}
+
+    def isUpToDate(self, dest, inputs, values=None):
+        entry = self._entries.get(dest)
+        if not entry or not os.path.isfile(dest):
+            return False
+
+        if entry["inputs"] != self._getFingerprints(inputs) or \
+           entry["values"] != self._getDigest(values):
+            return False
+
+        # Keep entry for the next build
+        with self._lock:
+            self._new_entries[dest] = entry
+        return True
+
+    def record(self, dest, inputs, values=None):
+        entry = {"inputs": self._getFingerprints(inputs),
+                 "values": self._getDigest(values)}
+        with self._lock:
+            self._new_entries[dest] = entry
+
+    def save(self):
+        # Only outputs of this build are saved, so removed files are dropped
+        mkdir(os.path.dirname(self._path))
+        tmp = self._path + ".tmp"
+        try:
+            with open(tmp, "wt") as f:
+                json.dump(self._new_entries, f, sort_keys=True)
+            os.replace(tmp, self._path)
+        except (IOError, OSError) as e:
+            log.warning("Warning: can't write build manifest " +
+                        self._path + ": " + str(e))
+
+        self._entries = self._new_entries
+        self._new_entries = {}
+        self._fingerprints = {}
+
+    def _getFingerprints(self, inputs):
+        result = {}
+        for i in inputs:
+            if not i:
+                continue
+            fp = self._fingerprints.get(i)
+            if fp is None:
+                try:
+                    st = os.stat(i)
+                    fp = [st.st_mtime_ns, st.st_size]
+                except OSError:
+                    fp = None
+                self._fingerprints[i] = fp
+            result[i] = fp
+        return result
+
+    def _getDigest(self, values):
+        if values is None:
+            return None
+        data = json.dumps(values, sort_keys=True, default=str)
+        return hashlib.sha1(data.encode()).hexdigest()
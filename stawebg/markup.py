@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+
+import importlib
+import sys
+import threading
+from subprocess import Popen, PIPE
+from stawebg.helper import fail, log
+
+
+class ToolConverter:
+    """ Start the markup tool for every document """
+    def __init__(self, tool):
+        self._tool = tool
+
+    def getKey(self):
+        return self._tool
+
+    def convert(self, text):
+        try:
+            p = Popen(self._tool, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        except PermissionError as e:
+            fail(' '.join(self._tool) + ": " + str(e))
+        except FileNotFoundError as e:
+            fail(' '.join(self._tool) + ": " + str(e))
+        out, err = p.communicate(text.encode())
+        if p.returncode:
+            fail(' '.join(self._tool) + ": " + err.decode())
+        if len(err):
+            log.warning("Warning from " + ' '.join(self._tool) + ": " + err.decode())
+        return out.decode()
+
+    def close(self):
+        pass
+
+
+class ModuleConverter:
+    """ Call a python function in this process, e.g. markdown:markdown """
+    def __init__(self, spec):
+        self._spec = spec
+        self._func = loadFunction(spec)
+
+    def getKey(self):
+        return ["module", self._spec]
+
+    def convert(self, text):
+        try:
+            return self._func(text)
+        except Exception as e:
+            fail(self._spec + ": " + str(e))
+
+    def close(self):
+        pass
+
+
+class WorkerConverter:
+    """ Send all documents to one long-lived process
+
+    Every document and every answer is sent as the length of the utf-8
+    encoded data in bytes, followed by a newline and the data itself.
+    """
+    def __init__(self, tool):
+        self._tool = tool
+        self._lock = threading.Lock()
+
+        try:
+            self._process = Popen(tool, stdin=PIPE, stdout=PIPE)
+        except (PermissionError, FileNotFoundError) as e:
+            fail(' '.join(self._tool) + ": " + str(e))
+
+    def getKey(self):
+        return ["worker"] + self._tool
+
+    def convert(self, text):
+        data = text.encode()
+
+        with self._lock:
+            try:
+                writeFrame(self._process.stdin, data)
+                result = readFrame(self._process.stdout)
+            except (IOError, ValueError) as e:
+                fail(' '.join(self._tool) + ": " + str(e))
+
+        if result is None:
+            fail(' '.join(self._tool) + ": worker exited unexpectedly")
+
+        return result.decode()
+
+    def close(self):
+        self._process.stdin.close()
+        self._process.wait()
+
+
+def createConverter(ext, markup, converters):
+    """ Create converter for ext, markup and converters are the configs """
+    tool = markup.get(ext) if markup else None
+    conf = converters.get(ext) if converters else None
+
+    if conf and conf.get("module"):
+        try:
+            return ModuleConverter(conf["module"])
+        except ImportError as e:
+            if not tool and not conf.get("worker"):
+                fail("Can't import converter " + conf["module"] + ": " + str(e))
+            log.warning("Warning: can't import converter " + conf["module"] +
+                        ": " + str(e))
+
+    if conf and conf.get("worker"):
+        return WorkerConverter(conf["worker"])
+
+    if tool:
+        return ToolConverter(tool)
+
+    return None
+
+
+def loadFunction(spec):
+    if ":" not in spec:
+        fail("Converter must be given as module:function: " + spec)
+
+    module, func = spec.split(":", 1)
+    try:
+        return getattr(importlib.import_module(module), func)
+    except AttributeError as e:
+        raise ImportError(str(e))
+
+
+def writeFrame(stream, data):
+    stream.write(str(len(data)).encode() + b"\n" + data)
+    stream.flush()
+
+
+def readFrame(stream):
+    line = stream.readline()
+    if not line:
+        return None
+    length = int(line)
+
+    data = stream.read(length)
+    if len(data) != length:
+        return None
+    return data
+
+
+def serve(spec):
+    """ Worker for WorkerConverter that calls a python function """
+    func = loadFunction(spec)
+    while True:
+        data = readFrame(sys.stdin.buffer)
+        if data is None:
+            break
+        writeFrame(sys.stdout.buffer, func(data.decode()).encode())
+
+
+if __name__ == "__main__":
+    # python3 -m stawebg.markup module:function
+    if len(sys.argv) != 2:
+        fail("Usage: " + sys.argv[0] + " module:function")
+    serve(sys.argv[1])
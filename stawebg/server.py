@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+
+import functools
+import os
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from stawebg.helper import flushLog, log
+
+RELOAD_PATH = "/__stawebg__/reload"
+
+# Added to every HTML page, reloads the page when the site was created again
+RELOAD_SCRIPT = ('<script>new EventSource("' + RELOAD_PATH + '").onmessage = '
+                 'function() { location.reload(); };</script>\n')
+
+
+class ReloadServer:
+    """ Serve a directory and tell open browsers to reload after a build """
+    def __init__(self, directory, port=8000, address="127.0.0.1"):
+        self._generation = 0
+        self._condition = threading.Condition()
+
+        handler = functools.partial(_Handler, self, directory=directory)
+        self._httpd = ThreadingHTTPServer((address, port), handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+        log.info("Serving on http://%s:%d/" % self._httpd.server_address[:2])
+        flushLog()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def notify(self):
+        """ Reload all open pages """
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    def waitForChange(self, generation, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: self._generation != generation,
+                                     timeout)
+            return self._generation
+
+    def getGeneration(self):
+        return self._generation
+
+
+class _Handler(SimpleHTTPRequestHandler):
+    def __init__(self, server, *args, **kwargs):
+        self._reload_server = server
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == RELOAD_PATH:
+            self._sendEvents()
+            return
+
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and self.path.endswith("/"):
+            path = os.path.join(path, "index.html")
+
+        if path.endswith(".html") and os.path.isfile(path):
+            self._sendHTML(path)
+        else:
+            super().do_GET()
+
+    def _sendHTML(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+
+        script = RELOAD_SCRIPT.encode()
+        pos = data.rfind(b"</body>")
+        if pos < 0:
+            data += script
+        else:
+            data = data[:pos] + script + data[pos:]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _sendEvents(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        generation = self._reload_server.getGeneration()
+        try:
+            while True:
+                new = self._reload_server.waitForChange(generation, 15)
+                if new != generation:
+                    generation = new
+                    self.wfile.write(b"data: reload\n\n")
+                else:
+                    # Keep the connection open
+                    self.wfile.write(b": ping\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+
+import contextlib
+import functools
+import heapq
+import threading
+import time
+
+
+class Stats:
+    """ Time spent in the phases of a build
+
+    Phases can overlap (e.g. markup conversion happens while a page is
+    created) and jobs running in parallel add up, so the sum of all phases
+    can be larger than the wall time.
+    """
+    phases = ["config", "layouts", "scan", "markup", "templates", "menu",
+              "blog", "rss", "copy", "cleanup"]
+
+    def __init__(self, enabled=True):
+        self._enabled = enabled
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+        # Key: phase
+        # Value: [seconds, count]
+        self._phases = dict((p, [0.0, 0]) for p in Stats.phases)
+
+        # Key: markup tool
+        # Value: [seconds, calls, cache hits]
+        self._tools = {}
+
+        # List of (seconds, output file)
+        self._pages = []
+
+    def isEnabled(self):
+        return self._enabled
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self._enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        if not self._enabled:
+            return
+        with self._lock:
+            entry = self._phases[name]
+            entry[0] += seconds
+            entry[1] += 1
+
+    def addTool(self, tool, seconds, cached=False):
+        if not self._enabled:
+            return
+        with self._lock:
+            entry = self._tools.setdefault(tool, [0.0, 0, 0])
+            if cached:
+                entry[2] += 1
+            else:
+                entry[0] += seconds
+                entry[1] += 1
+
+    def addPage(self, dest, seconds):
+        if not self._enabled:
+            return
+        with self._lock:
+            self._pages.append((seconds, dest))
+
+    def merge(self, data):
+        """ Add statistics from toDict(None) of another process """
+        if not self._enabled:
+            return
+        with self._lock:
+            for p, v in data["phases"].items():
+                self._phases[p][0] += v["seconds"]
+                self._phases[p][1] += v["count"]
+            for t, v in data["markup"].items():
+                entry = self._tools.setdefault(t, [0.0, 0, 0])
+                entry[0] += v["seconds"]
+                entry[1] += v["calls"]
+                entry[2] += v["cached"]
+            self._pages.extend((p["seconds"], p["file"])
+                               for p in data["slowest"])
+
+    def getWallTime(self):
+        return time.perf_counter() - self._start
+
+    def toDict(self, slowest=10):
+        """ slowest is the number of pages to include, None for all """
+        if slowest is None:
+            slowest = len(self._pages)
+        return {"wall": self.getWallTime(),
+                "pages": len(self._pages),
+                "phases": dict((p, {"seconds": v[0], "count": v[1]})
+                               for p, v in self._phases.items()),
+                "markup": dict((t, {"seconds": v[0], "calls": v[1],
+                                    "cached": v[2]})
+                               for t, v in self._tools.items()),
+                "slowest": [{"seconds": s, "file": f} for s, f in
+                            heapq.nlargest(slowest, self._pages)]}
+
+    def report(self, slowest=10):
+        data = self.toDict(slowest)
+        lines = ["Build statistics:",
+                 "  %-12s %10.3f s" % ("wall time", data["wall"]),
+                 "  %-12s %10d" % ("pages", data["pages"]),
+                 "Phases:"]
+        for p in Stats.phases:
+            lines.append("  %-12s %10.3f s %8d x" %
+                         (p, data["phases"][p]["seconds"],
+                          data["phases"][p]["count"]))
+
+        if data["markup"]:
+            lines.append("Markup conversion:")
+            for t in sorted(data["markup"]):
+                v = data["markup"][t]
+                lines.append("  %-30s %10.3f s %8d calls %8d cached" %
+                             (t, v["seconds"], v["calls"], v["cached"]))
+
+        if data["slowest"]:
+            lines.append("Slowest pages:")
+            for p in data["slowest"]:
+                lines.append("  %10.3f s  %s" % (p["seconds"], p["file"]))
+
+        return "\n".join(lines)
+
+
+def timed(phase):
+    """ Decorator for methods of objects with getStats() """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.getStats().phase(phase):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
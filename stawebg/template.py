@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+import functools
+import re
+
+CONTENT = "%CONTENT%"
+
+# Kinds of template parts
+LITERAL = 0
+CONTENT_SLOT = 1
+USER_SLOT = 2
+REP_SLOT = 3
+
+
+class Template:
+    """ Template text, parsed into literal parts and placeholders
+
+    Rendering gives the same result as replacing in this order:
+    user variables, %CONTENT%, user variables again, other keywords
+    """
+    def __init__(self, text):
+        self._text = text
+
+        # Key: (user variable names, keyword names)
+        # Value: list of (kind, value)
+        self._compiled = {}
+
+    def getText(self):
+        return self._text
+
+    def render(self, user_reps, reps, content):
+        key = (tuple(user_reps), tuple(reps))
+        parts = self._compiled.get(key)
+        if parts is None:
+            parts = self._compile(key[0], key[1])
+            self._compiled[key] = parts
+
+        # Content and user variables are replaced before the second round of
+        # user variables and other keywords, so they are scanned for them
+        expand = lambda t: replaceKeywords(replaceKeywords(t, user_reps), reps)
+
+        result = []
+        expanded_content = None
+        for kind, value in parts:
+            if kind == LITERAL:
+                result.append(value)
+            elif kind == REP_SLOT:
+                result.append(reps[value])
+            elif kind == CONTENT_SLOT:
+                if expanded_content is None:
+                    expanded_content = expand(content)
+                result.append(expanded_content)
+            else:
+                result.append(expand(user_reps[value].replace(CONTENT,
+                                                              content)))
+
+        return "".join(result)
+
+    def _compile(self, user_keys, rep_keys):
+        parts = []
+        for n, user_part in enumerate(splitKeywords(self._text, user_keys)):
+            if n % 2:
+                parts.append((USER_SLOT, user_part))
+                continue
+
+            for m, content_part in enumerate(user_part.split(CONTENT)):
+                if m:
+                    parts.append((CONTENT_SLOT, None))
+
+                for k, rep_part in enumerate(splitKeywords(content_part,
+                                                           rep_keys)):
+                    if k % 2:
+                        parts.append((REP_SLOT, rep_part))
+                    elif rep_part:
+                        parts.append((LITERAL, rep_part))
+
+        return parts
+
+
+@functools.lru_cache(maxsize=256)
+def _getRegex(keys):
+    return re.compile('(' + '|'.join(map(re.escape, keys)) + ')')
+
+
+def splitKeywords(text, keys):
+    """ Returns literal text and keywords alternately """
+    if not keys:
+        return [text]
+    return _getRegex(tuple(keys)).split(text)
+
+
+def replaceKeywords(text, reps):
+    if not reps:
+        return text
+
+    trans = lambda m: reps[m.group(0)]
+    return _getRegex(tuple(reps)).sub(trans, text)
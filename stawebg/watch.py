@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from stawebg.helper import flushLog, log, walkFiles
+from stawebg.server import ReloadServer
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+IN_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+           IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+# Wait this long for more changes, editors often write several times
+SETTLE_TIME = 0.1
+
+
+class PollingWatcher:
+    """ Find changes by comparing size and modification time """
+    def __init__(self, paths, interval=0.5):
+        self._paths = paths
+        self._interval = interval
+        self._state = self._scan()
+
+    def wait(self):
+        """ Block until something changed and return the changed files """
+        while True:
+            time.sleep(self._interval)
+            state = self._scan()
+            changed = [p for p in set(state) | set(self._state)
+                       if state.get(p) != self._state.get(p)]
+            self._state = state
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+    def _scan(self):
+        state = {}
+        for path in self._paths:
+            if os.path.isdir(path):
+                for e in walkFiles(path):
+                    try:
+                        st = e.stat()
+                        state[e.path] = (st.st_mtime_ns, st.st_size)
+                    except OSError:
+                        pass
+            elif os.path.isfile(path):
+                st = os.stat(path)
+                state[path] = (st.st_mtime_ns, st.st_size)
+        return state
+
+
+class InotifyWatcher:
+    """ Get changes from the linux kernel """
+    def __init__(self, paths):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        # Key: watch descriptor
+        # Value: directory
+        self._dirs = {}
+
+        # Directories watched with all their subdirectories
+        self._trees = set()
+
+        # Files are watched through their directory
+        self._files = set()
+
+        for path in paths:
+            if os.path.isdir(path):
+                self._addTree(path)
+            else:
+                self._files.add(path)
+                self._add(os.path.dirname(path))
+
+    def wait(self):
+        """ Block until something changed and return the changed files """
+        changed = set()
+        timeout = None
+        while True:
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+            if not ready:
+                if changed:
+                    return list(changed)
+                continue
+            changed.update(self._read())
+            timeout = SETTLE_TIME
+
+    def close(self):
+        os.close(self._fd)
+
+    def _read(self):
+        data = os.read(self._fd, 65536)
+        changed = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = struct.unpack_from("iIII", data, pos)
+            pos += struct.calcsize("iIII")
+            name = data[pos:pos+length].rstrip(b"\0").decode(errors="replace")
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so everything may have changed and the
+                # watched files (the global config) trigger a full reload
+                changed.extend(self._files)
+                continue
+
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name) if name else directory
+
+            # Directories that are only watched for some files
+            if directory not in self._trees and path not in self._files:
+                continue
+
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._addTree(path)
+            changed.append(path)
+
+        return changed
+
+    def _add(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path),
+                                          IN_MASK)
+        if wd >= 0:
+            self._dirs[wd] = path
+
+    def _addTree(self, path):
+        for d, dirs, files in os.walk(path):
+            self._trees.add(d)
+            self._add(d)
+
+
+def createWatcher(paths):
+    """ Use inotify where available, poll otherwise """
+    try:
+        return InotifyWatcher(paths)
+    except (OSError, AttributeError, TypeError):
+        return PollingWatcher(paths)
+
+
+def watch(create_project, port=None):
+    """ Create the project again whenever a file changes
+
+    create_project creates and builds a new Project. It is called again if
+    the global config changes, otherwise only affected sites are rebuilt.
+    If port is given, the output directory is served on localhost.
+    """
+    project = create_project()
+    watcher = createWatcher(project.getWatchPaths())
+
+    server = None
+    if port is not None:
+        server = ReloadServer(project.getOutputDir(), port)
+        server.start()
+
+    config_file = project.getWatchPaths()[0]
+    log.info("Watching for changes, press Ctrl-C to stop")
+    flushLog()
+
+    try:
+        while True:
+            changed = watcher.wait()
+            start = time.time()
+            try:
+                if config_file in changed:
+                    project.close()
+                    project = create_project()
+                    watcher.close()
+                    watcher = createWatcher(project.getWatchPaths())
+                else:
+                    project.rebuild(changed)
+            except SystemExit:
+                # fail() already printed the error, keep on watching
+                log.warning("Build failed")
+                continue
+
+            log.info("Done in %.2f s" % (time.time() - start))
+            flushLog()
+            if server:
+                server.notify()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        project.close()
+        if server:
+            server.stop()
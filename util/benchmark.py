@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+
+"""
+Create a synthetic project and measure how long stawebg needs for it:
+
+    python3 util/benchmark.py [options]
+
+Every run builds the project in a new process, so the peak RSS of the runs
+can be compared. Markup is "converted" by str() in the same process, so
+only stawebg itself is measured; --markup tool runs "cat" for every page
+instead. Use --json to save the results and --compare to show the
+difference to results of an earlier commit.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from stawebg.data import Project, version
+
+LAYOUT_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "layouts",
+                          "default")
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do "
+         "eiusmod tempor incididunt ut labore et dolore magna aliqua").split()
+
+
+def text(rnd, paragraphs):
+    """ Some paragraphs with links, like a normal page """
+    result = []
+    for i in range(paragraphs):
+        words = [rnd.choice(WORDS) for j in range(rnd.randint(30, 80))]
+        words.append('<a href="%ROOT%">home</a>')
+        result.append("<p>" + " ".join(words) + "</p>")
+    return "\n".join(result) + "\n"
+
+
+def writeFile(path, content):
+    with open(path, "wt") as f:
+        f.write(content)
+
+
+def writeJSON(path, data):
+    with open(path, "wt") as f:
+        json.dump(data, f, indent=4)
+
+
+def generate(root, pages=1000, depth=3, blog=100, assets=100, layouts=1,
+             markup="module", per_dir=10, seed=0):
+    """ Create a project with one site in root """
+    rnd = random.Random(seed)
+
+    for i in range(layouts):
+        shutil.copytree(LAYOUT_DIR, os.path.join(root, "layouts",
+                                                 "layout-%d" % i))
+
+    writeJSON(os.path.join(root, "stawebg.json"),
+              {"dirs": {"sites": "sites", "layouts": "layouts", "out": "out"},
+               "files": {"index": [".*index\\.md$"],
+                         "content": [".*\\.md$"],
+                         "hidden": [],
+                         "exclude": [".*stawebg\\.json$"]},
+               "markup": {".md": ["cat"]},
+               "converters": {".md": {"module": "builtins:str"}
+                              if markup == "module" else {}},
+               "variables": {"COPYRIGHT": "Benchmark"},
+               "layout": "layout-0",
+               "delete-old": True})
+
+    site = os.path.join(root, "sites", "bench")
+    os.makedirs(site)
+    writeJSON(os.path.join(root, "sites", "bench.json"),
+              {"title": "Benchmark", "subtitle": "synthetic site",
+               "url": "http://www.example.org"})
+
+    # Directories as a tree with the given depth, the parent of directory i
+    # is directory (i - 1) // branching and directory 0 is the site itself
+    count = max(1, (pages + per_dir - 1) // per_dir)
+    branching = 2
+    while sum(branching ** d for d in range(depth + 1)) < count:
+        branching += 1
+
+    dirs = [site]
+    for i in range(1, count):
+        parent = dirs[(i - 1) // branching]
+        path = os.path.join(parent, "dir-%d" % i)
+        os.mkdir(path)
+        if layouts > 1:
+            writeJSON(os.path.join(path, "stawebg.json"),
+                      {"layout": "layout-%d" % (i % layouts)})
+        dirs.append(path)
+
+    for i in range(pages):
+        d = dirs[i % count]
+        if i < count:
+            name = "index.md"
+        else:
+            name = "page-%d.md" % i
+        writeFile(os.path.join(d, name), text(rnd, rnd.randint(1, 10)))
+
+    for i in range(assets):
+        d = dirs[rnd.randrange(count)]
+        with open(os.path.join(d, "asset-%d.bin" % i), "wb") as f:
+            f.write(os.urandom(rnd.randint(1, 64) * 1024))
+
+    if blog:
+        news = os.path.join(site, "news")
+        os.makedirs(os.path.join(news, "data"))
+        writeFile(os.path.join(news, "index.md"), text(rnd, 1))
+        writeJSON(os.path.join(news, "stawebg.json"),
+                  {"blog": {"dir": "data", "per-page": 10, "max-pages": 0}})
+        for i in range(blog):
+            minutes = i * 617
+            name = "2014-%02d-%02d-%02d-%02d-entry-%d.md" % (
+                (minutes // 40320) % 12 + 1, (minutes // 1440) % 28 + 1,
+                (minutes // 60) % 24, minutes % 60, i)
+            writeFile(os.path.join(news, "data", name),
+                      text(rnd, rnd.randint(1, 10)))
+
+
+def run(root, jobs, cache):
+    """ Build the project in this process, return the results as dict """
+    devnull = open(os.devnull, "wt")
+    stdout = sys.stdout
+    sys.stdout = devnull
+    try:
+        project = Project(root, False, None, cache, False, False, jobs, True)
+        project.close()
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+
+    result = project.getStats().toDict()
+    # Kilobytes on Linux
+    result["peak-rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summary(runs):
+    """ Best run of each value """
+    best = {"wall": min(r["wall"] for r in runs),
+            "peak-rss": min(r["peak-rss"] for r in runs),
+            "phases": {}}
+    for p in runs[0]["phases"]:
+        best["phases"][p] = min(r["phases"][p]["seconds"] for r in runs)
+    return best
+
+
+def printResults(best, old=None):
+    def line(name, value, unit, old_value):
+        diff = ""
+        if old_value:
+            diff = "%+7.1f %%" % ((value - old_value) / old_value * 100)
+        print(("  %-12s %12.3f %-3s %s" % (name, value, unit, diff)).rstrip())
+
+    old = old or {"phases": {}}
+    line("wall time", best["wall"], "s", old.get("wall"))
+    line("peak RSS", best["peak-rss"] / 1024, "MiB",
+         old.get("peak-rss", 0) / 1024)
+    for p, seconds in best["phases"].items():
+        line(p, seconds, "s", old["phases"].get(p))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="stawebg benchmark")
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=3,
+                        help="depth of the directory tree")
+    parser.add_argument("--blog", type=int, default=100,
+                        help="number of blog entries")
+    parser.add_argument("--assets", type=int, default=100,
+                        help="number of other files")
+    parser.add_argument("--layouts", type=int, default=1)
+    parser.add_argument("--markup", choices=["module", "tool"],
+                        default="module",
+                        help="convert markup in process or with a tool")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    parser.add_argument("--cache", action="store_true",
+                        help="use the markup cache (warm after the first run)")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("--keep", metavar="dir", type=str, default=None,
+                        help="create the project in this directory and keep it")
+    parser.add_argument("--json", metavar="file", type=str, default=None,
+                        help="write the results to this file")
+    parser.add_argument("--compare", metavar="file", type=str, default=None,
+                        help="compare with results from --json")
+    parser.add_argument("--run", metavar="dir", type=str, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process: build once and print the results
+    if args.run:
+        json.dump(run(args.run, args.jobs, args.cache), sys.stdout)
+        sys.exit(0)
+
+    params = {"pages": args.pages, "depth": args.depth, "blog": args.blog,
+              "assets": args.assets, "layouts": args.layouts,
+              "markup": args.markup,
+              "seed": args.seed, "jobs": args.jobs, "cache": args.cache}
+
+    root = args.keep or tempfile.mkdtemp(prefix="stawebg-benchmark-")
+    try:
+        if not os.path.exists(os.path.join(root, "stawebg.json")):
+            generate(root, args.pages, args.depth, args.blog, args.assets,
+                     args.layouts, args.markup, seed=args.seed)
+
+        runs = []
+        for i in range(args.repeat):
+            # Every run starts with an empty output directory
+            shutil.rmtree(os.path.join(root, "out"), ignore_errors=True)
+            cmd = [sys.executable, os.path.abspath(__file__), "--run", root,
+                   "--jobs", str(args.jobs)]
+            if args.cache:
+                cmd.append("--cache")
+            runs.append(json.loads(subprocess.check_output(cmd)))
+            print("run %d: %.3f s" % (i + 1, runs[-1]["wall"]))
+    finally:
+        if not args.keep:
+            shutil.rmtree(root)
+
+    best = summary(runs)
+    result = {"commit": gitCommit(), "version": version,
+              "python": platform.python_version(), "params": params,
+              "best": best, "runs": runs}
+
+    old = None
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if old["params"] != params:
+            print("Warning: compared results used other parameters")
+        print("Best of %d runs, compared with %s:" %
+              (args.repeat, old.get("commit")))
+        old = old["best"]
+    else:
+        print("Best of %d runs:" % args.repeat)
+    printResults(best, old)
+
+    if args.json:
+        with open(args.json, "wt") as f:
+            json.dump(result, f, indent=4)
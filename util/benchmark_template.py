@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+"""
+Compare compiled templates with the old regex replacement:
+
+    python3 util/benchmark_template.py [layout directory]
+
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from stawebg.template import Template
+
+
+def oldReplaceKeywords(text, reps):
+    if not reps:
+        return text
+
+    trans = lambda m: reps[m.group(0)]
+    rc = re.compile('|'.join(map(re.escape, reps)))
+    return rc.sub(trans, text)
+
+
+def oldPrepareTemplate(template, user_reps, reps, content):
+    text = oldReplaceKeywords(template, user_reps)
+    text = text.replace("%CONTENT%", content)
+    text = oldReplaceKeywords(text, user_reps)
+    return oldReplaceKeywords(text, reps)
+
+
+if __name__ == "__main__":
+    layout = os.path.join(os.path.dirname(__file__), "..", "data", "layouts",
+                          "default")
+    if len(sys.argv) > 1:
+        layout = sys.argv[1]
+
+    with open(os.path.join(layout, "template.html")) as f:
+        text = f.read()
+
+    user_reps = {"%_COPYRIGHT%": "Sven Hertle", "%_AUTHOR%": "Markus Teich"}
+    reps = {"%ROOT%": "../../", "%CUR%": "", "%LAYOUT%": "../../style/default/",
+            "%TITLE%": "Site > Page", "%SITETITLE%": "Site",
+            "%SITESUBTITLE%": "Subtitle", "%MENU%": "<ul>\n</ul>\n" * 20,
+            "%VERSION%": "0.1-dev", "%GENERATIONTIME%": "01 January 2014",
+            "%GENERATIONYEAR%": "2014", "%URL%": "http://www.example.org"}
+    content = "<p>Lorem ipsum dolor sit amet, %ROOT%.</p>\n" * 50
+
+    template = Template(text)
+    if template.render(user_reps, reps, content) != \
+       oldPrepareTemplate(text, user_reps, reps, content):
+        sys.exit("Error: results differ")
+
+    number = 10000
+    old = timeit.timeit(lambda: oldPrepareTemplate(text, user_reps, reps,
+                                                   content), number=number)
+    new = timeit.timeit(lambda: template.render(user_reps, reps, content),
+                        number=number)
+
+    print("regex replacement: %.2f us per page" % (old / number * 1e6))
+    print("compiled template: %.2f us per page" % (new / number * 1e6))
+    print("speedup:           %.2fx" % (old / new))